@@ -3,10 +3,24 @@
 # manteniendo un catálogo actualizado con metadatos, paradatos de riesgos y criticidad.
 # oswaldo.diaz@inegi.org.mx
 # _____________________
+import copy
 import time
 import threading
 import random
-from datetime import datetime
+import functools
+import ipaddress
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+import numpy as np
+
+CRITICALITY_LEVELS = np.array(['low', 'medium', 'high'])
+
+# Parámetros del barrido fping; también determinan el tiempo máximo que se le concede
+FPING_TIMEOUT_MS = 500    # espera inicial por respuesta (-t)
+FPING_RETRIES = 1         # reintentos por host (-r)
+FPING_INTERVAL_MS = 10    # separación entre paquetes enviados (-i)
+FPING_BACKOFF = 1.5       # factor de fping para alargar la espera en cada reintento (-B)
 
 class Asset:
     """
@@ -16,14 +30,26 @@ class Asset:
         self.id = identifier                  # Identificador único (IP, MAC, nombre de servicio...)
         self.kind = kind                      # Tipo: 'asset', 'sensor', 'service'
         self.metadata = metadata or {}        # Información descriptiva (fabricante, versión, ubicación...)
-        self.last_seen = datetime.utcnow()    # Fecha y hora del último descubrimiento
+        self.last_seen_ns = time.time_ns()    # Marca de tiempo (ns, UTC) del último descubrimiento
         self.risk_score = 0                   # Puntaje de riesgo asignado
         self.criticality = 'low'              # Nivel de criticidad: 'low', 'medium', 'high'
 
     def update(self, metadata_update):
         """Actualiza metadatos y la última vez visto."""
         self.metadata.update(metadata_update)
-        self.last_seen = datetime.utcnow()
+        self.last_seen_ns = time.time_ns()
+
+    def updated(self, metadata_update):
+        """Devuelve una copia con los metadatos fusionados; el original no se modifica."""
+        clone = copy.copy(self)
+        clone.metadata = {**self.metadata, **metadata_update}
+        clone.last_seen_ns = time.time_ns()
+        return clone
+
+    @property
+    def last_seen(self):
+        """Fecha y hora del último descubrimiento; se construye solo al consultarla."""
+        return datetime.fromtimestamp(self.last_seen_ns / 1e9, tz=timezone.utc)
 
     def evaluate_risk(self, factors):
         """
@@ -44,70 +70,134 @@ class Asset:
         else:
             self.criticality = 'low'
 
+def evaluate_risk_batch(factors_list):
+    """
+    Versión vectorizada de Asset.evaluate_risk para un lote de hallazgos.
+    Empaqueta los factores en arreglos contiguos (estructura de arreglos) y calcula
+    puntajes y criticidades en una sola pasada de NumPy.
+    factors_list: lista de dicts con llaves 'vulnerabilities', 'threat_level'
+    Retorna (puntajes float64, criticidades como arreglo de str).
+    """
+    n = len(factors_list)
+    vuln = np.fromiter((f.get('vulnerabilities', 0) for f in factors_list), dtype=np.float64, count=n)
+    threat = np.fromiter((f.get('threat_level', 0) for f in factors_list), dtype=np.float64, count=n)
+    risk = np.minimum(vuln * 5 + threat * 10, 100)
+    criticality = CRITICALITY_LEVELS[(risk >= 40).astype(np.intp) + (risk >= 75)]
+    return risk, criticality
+
 class Catalog:
     """
     Catálogo centralizado que mantiene los activos descubiertos.
     """
     def __init__(self):
-        self._store = {}  # Diccionario: clave=id, valor=Asset
-        self._lock = threading.Lock()
+        # Diccionario: clave=id, valor=Asset. Nunca se muta tras publicarse: las altas
+        # crean una copia nueva (copy-on-write), así los lectores no necesitan bloqueo.
+        self._store = {}
+        self._lock = threading.Lock()  # Serializa únicamente a los escritores
+        self._inflight = {}  # id -> threading.Event de una construcción de Asset en curso
 
     def add_or_update(self, asset):
         """Agrega un nuevo activo o actualiza uno existente."""
         with self._lock:
-            if asset.id in self._store:
-                existing = self._store[asset.id]
-                existing.update(asset.metadata)
-            else:
-                self._store[asset.id] = asset
+            existing = self._store.get(asset.id)
+            self._publish(existing.updated(asset.metadata) if existing is not None else asset)
+
+    def _publish(self, asset):
+        """Publica `asset` sustituyendo el diccionario completo; requiere tener `_lock`."""
+        store = dict(self._store)
+        store[asset.id] = asset
+        self._store = store
+
+    def add_or_build(self, identifier, metadata, factory):
+        """
+        Actualiza el activo `identifier` o, si no existe, lo construye con `factory()`.
+        Si otro hilo ya está construyendo el mismo id, espera a que termine y solo
+        actualiza sus metadatos (single-flight), evitando construcciones duplicadas.
+        """
+        while True:
+            with self._lock:
+                existing = self._store.get(identifier)
+                if existing is not None:
+                    # Copia nueva en lugar de mutar el Asset que los lectores ya tienen
+                    asset = existing.updated(metadata)
+                    self._publish(asset)
+                    return asset
+                event = self._inflight.get(identifier)
+                if event is None:
+                    event = self._inflight[identifier] = threading.Event()
+                    break
+            event.wait()
+
+        try:
+            asset = factory()
+            self.add_or_update(asset)
+        finally:
+            with self._lock:
+                self._inflight.pop(identifier, None)
+            event.set()
+        return asset
 
     def list_assets(self):
         """Lista todos los activos en el catálogo."""
-        with self._lock:
-            return list(self._store.values())
+        return list(self._store.values())
 
     def print_summary(self):
         """Imprime un resumen de cada activo, con riesgo y criticidad."""
-        with self._lock:
-            for a in self._store.values():
-                print(f"ID: {a.id} | Tipo: {a.kind} | Riesgo: {a.risk_score} | Criticidad: {a.criticality} | Última vez visto: {a.last_seen}")
+        for a in self._store.values():
+            print(f"ID: {a.id} | Tipo: {a.kind} | Riesgo: {a.risk_score} | Criticidad: {a.criticality} | Última vez visto: {a.last_seen}")
 
 class DiscoveryAgent(threading.Thread):
     """
     Agente que ejecuta descubrimiento periódico en red.
     """
-    def __init__(self, catalog, interval=30):
+    def __init__(self, catalog, interval=30, subnets=None, max_workers=16):
         super().__init__(daemon=True)
         self.catalog = catalog
         self.interval = interval  # segundos entre descubrimientos
+        self.subnets = subnets or ['192.168.1.0/24']  # redes a escanear en paralelo
+        self.max_workers = max_workers  # hilos concurrentes de escaneo
         self.running = True
 
     def run(self):
-        while self.running:
-            found = self._scan_network()
-            for data in found:
-                asset = self._make_asset(data)
-                asset.evaluate_risk(data.get('factors', {}))
-                self.catalog.add_or_update(asset)
-            time.sleep(self.interval)
+        # El escaneo es de E/S (nmap, SNMP, APIs), por lo que los hilos no compiten por el GIL
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while self.running:
+                futures = [executor.submit(self._scan_subnet, subnet) for subnet in self.subnets]
+                for future in as_completed(futures):
+                    found = future.result()
+                    risks, criticalities = evaluate_risk_batch([d.get('factors', {}) for d in found])
+                    for data, risk, criticality in zip(found, risks.tolist(), criticalities.tolist()):
+                        self.catalog.add_or_build(data['id'], data['metadata'],
+                                                  functools.partial(self._build_asset, data, risk, criticality))
+                time.sleep(self.interval)
 
     def stop(self):
         self.running = False
 
-    def _scan_network(self):
+    def _scan_subnet(self, subnet):
         """
-        Simulación de escaneo: devuelve lista de diccionarios con datos.
+        Simulación de escaneo de una subred: devuelve lista de diccionarios con datos.
+        Solo se sondean en profundidad los hosts que respondieron al barrido ICMP.
         """
         # En un entorno real, podrías usar nmap, SNMP, API de nube, etc.
+        alive_hosts = self._ping_sweep(subnet)
+        if alive_hosts is None:
+            # Sin fping utilizable: simular entre 1 y 5 hosts activos
+            network = ipaddress.ip_network(subnet)
+            if network.num_addresses <= 2:
+                # /31 y /32 no tienen direcciones de red/broadcast que excluir
+                first, last = 0, network.num_addresses - 1
+            else:
+                first, last = 1, network.num_addresses - 2
+            alive_hosts = [str(network[random.randint(first, last)])
+                           for _ in range(random.randint(1,5))]
         sample = []
         kinds = ['asset', 'sensor', 'service']
-        # Simular entre 1 y 5 hallazgos
-        count = random.randint(1,5)
-        for _ in range(count):
+        for ip in alive_hosts:
             identifier = f"node-{random.randint(1,20)}"
             kind = random.choice(kinds)
             metadata = {
-                'ip': f"192.168.1.{random.randint(1,254)}",
+                'ip': ip,
                 'version': f"v{random.randint(1,3)}.{random.randint(0,9)}",
             }
             factors = {
@@ -117,11 +207,48 @@ class DiscoveryAgent(threading.Thread):
             sample.append({ 'id': identifier, 'kind': kind, 'metadata': metadata, 'factors': factors })
         return sample
 
+    def _ping_sweep(self, subnet):
+        """
+        Prefiltro ICMP con fping: devuelve las IPs de la subred que responden,
+        o None si fping no está instalado o no pudo ejecutar el barrido.
+        Si fping excede su plazo se devuelven todos los hosts de la subred sin filtrar.
+        """
+        network = ipaddress.ip_network(subnet)
+        attempts = FPING_RETRIES + 1
+        # Envío de todos los paquetes más la espera del último (con backoff), más holgura
+        send_ms = network.num_addresses * attempts * FPING_INTERVAL_MS
+        wait_ms = sum(FPING_TIMEOUT_MS * FPING_BACKOFF ** k for k in range(attempts))
+        timeout = (send_ms + wait_ms) / 1000 + 5
+        try:
+            result = subprocess.run(['fping', '-a', '-q', '-g',
+                                     '-t', str(FPING_TIMEOUT_MS), '-r', str(FPING_RETRIES),
+                                     '-i', str(FPING_INTERVAL_MS), '-B', str(FPING_BACKOFF),
+                                     subnet],
+                                    capture_output=True, text=True, timeout=timeout)
+        except (FileNotFoundError, PermissionError):
+            return None
+        except subprocess.TimeoutExpired:
+            # Un barrido colgado no prueba que no haya hosts: se sondean todos
+            return [str(ip) for ip in network.hosts()]
+        # fping termina con 1 si algún host no responde (barrido válido); 2 o más indica
+        # error (dirección inválida, argumentos, permisos de socket): no es "sin hosts".
+        if result.returncode > 1:
+            return None
+        # La salida estándar contiene únicamente los hosts vivos.
+        return result.stdout.split()
+
     def _make_asset(self, data):
         """Construye un objeto Asset a partir de datos crudos."""
         a = Asset(data['id'], data['kind'], data['metadata'])
         return a
 
+    def _build_asset(self, data, risk_score, criticality):
+        """Construye el Asset con el riesgo ya calculado en lote; solo se invoca para ids nuevos."""
+        asset = self._make_asset(data)
+        asset.risk_score = risk_score
+        asset.criticality = criticality
+        return asset
+
 if __name__ == "__main__":
     # Ejecución de ejemplo
     catalog = Catalog()
@@ -4,18 +4,22 @@
 # (Key Performance Indicators, en español Indicadores Clave de Rendimiento o Desempeño.) y marcos regulatorios.
 # oswaldo.diaz@inegi.org.mx
 # _____________________
+import sys
 import time
 from typing import Dict, Any
 
+import numpy as np
+
 class MetricsCollector:
     """
     Recoge métricas de ciberresiliencia: tiempo de detección, respuesta y restauración.
     """
     def __init__(self):
+        # Cada métrica guarda [suma acumulada, número de muestras] para promediar en O(1)
         self.metrics = {
-            'detection_time': [],  # Tiempo desde el incidente hasta la detección
-            'response_time': [],   # Tiempo desde la detección hasta el inicio de la respuesta
-            'recovery_time': []    # Tiempo desde el inicio de la respuesta hasta la recuperación
+            'detection_time': [0.0, 0],  # Tiempo desde el incidente hasta la detección
+            'response_time': [0.0, 0],   # Tiempo desde la detección hasta el inicio de la respuesta
+            'recovery_time': [0.0, 0]    # Tiempo desde el inicio de la respuesta hasta la recuperación
         }
 
     def record(self, detection: float, response: float, recovery: float):
@@ -27,9 +31,12 @@ class MetricsCollector:
             response (float): segundos hasta la respuesta
             recovery (float): segundos hasta la restauración
         """
-        self.metrics['detection_time'].append(detection)
-        self.metrics['response_time'].append(response)
-        self.metrics['recovery_time'].append(recovery)
+        for key, value in (('detection_time', detection),
+                           ('response_time', response),
+                           ('recovery_time', recovery)):
+            acc = self.metrics[key]
+            acc[0] += value
+            acc[1] += 1
 
     def get_averages(self) -> Dict[str, float]:
         """
@@ -39,8 +46,8 @@ class MetricsCollector:
             Dict[str, float]: promedio de cada métrica.
         """
         return {
-            k: sum(v) / len(v) if v else float('inf')
-            for k, v in self.metrics.items()
+            k: total / count if count else float('inf')
+            for k, (total, count) in self.metrics.items()
         }
 
 class ControlEvaluator:
@@ -49,6 +56,9 @@ class ControlEvaluator:
     """
     def __init__(self, kpis: Dict[str, float]):
         self.kpis = kpis  # Objetivos deseados para cada métrica
+        # Orden fijo de KPIs y sus objetivos como arreglo para comparar en una sola operación
+        self._keys = tuple(kpis)
+        self._targets = np.array([kpis[k] for k in self._keys], dtype=np.float64)
 
     def evaluate(self, averages: Dict[str, float]) -> Dict[str, bool]:
         """
@@ -60,11 +70,12 @@ class ControlEvaluator:
         Returns:
             Dict[str, bool]: True si cumple, False si falla.
         """
-        results = {}
-        for metric, avg in averages.items():
-            target = self.kpis.get(metric)
-            # Menor o igual a objetivo -> cumple
-            results[metric] = (avg <= target) if target is not None else False
+        # Métricas sin KPI definido -> no cumple
+        results = dict.fromkeys(averages, False)
+        avgs = np.array([averages.get(k, np.inf) for k in self._keys], dtype=np.float64)
+        # Menor o igual a objetivo -> cumple
+        passed = avgs <= self._targets
+        results.update((k, ok) for k, ok in zip(self._keys, passed.tolist()) if k in averages)
         return results
 
 class PolicyAdjuster:
@@ -74,6 +85,13 @@ class PolicyAdjuster:
     def __init__(self, regulatory_requirements: Dict[str, Any]):
         self.requirements = regulatory_requirements
         self.policies = {}  # Almacena políticas activas
+        # Nombres de política internados por métrica, construidos una sola vez
+        self._policy_names = {}
+        # Acción por defecto de cada requisito regulatorio, precalculada
+        self._defaults = tuple(
+            (req, rule.get('default_action', 'review'))
+            for req, rule in regulatory_requirements.items()
+        )
 
     def adjust(self, evaluation: Dict[str, bool]):
         """
@@ -82,8 +100,11 @@ class PolicyAdjuster:
         Args:
             evaluation (Dict[str, bool]): resultado de la evaluación de controles.
         """
+        policy_names = self._policy_names
         for metric, passed in evaluation.items():
-            policy_name = f"policy_{metric}"
+            policy_name = policy_names.get(metric)
+            if policy_name is None:
+                policy_name = policy_names[metric] = sys.intern(f"policy_{metric}")
             if not passed:
                 # Ejemplo sencillo: incrementar severidad o frecuencia de controles
                 self.policies[policy_name] = 'tighten'
@@ -91,10 +112,10 @@ class PolicyAdjuster:
                 self.policies[policy_name] = 'maintain'
 
         # Validar contra requisitos regulatorios
-        for req, rule in self.requirements.items():
+        for req, default_action in self._defaults:
             if req not in self.policies:
                 # Asegurar que todas las regulaciones estén cubiertas
-                self.policies[req] = rule.get('default_action', 'review')
+                self.policies[req] = default_action
 
     def get_policies(self) -> Dict[str, str]:
         """
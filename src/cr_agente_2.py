@@ -5,10 +5,19 @@
 # ____________________________
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
+import pyarrow.csv as pacsv
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
+from sklearn.compose import ColumnTransformer
+from sklearn.preprocessing import OneHotEncoder
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, accuracy_score
 
+try:
+    # Random Forest en GPU (RAPIDS cuML) con la misma API que scikit-learn
+    from cuml.ensemble import RandomForestClassifier as GPURandomForestClassifier
+except ImportError:
+    GPURandomForestClassifier = None
+
 class MLAgent:
     """
     MLAgent analiza vulnerabilidades pasadas y predice riesgos emergentes,
@@ -21,13 +30,18 @@ class MLAgent:
         """
         self.data_path = data_path
         self.model = None
+        self.preprocessor = None
         self.controls = None
 
     def load_data(self):
         """
         Carga los datos de vulnerabilidades desde un CSV y muestra las primeras filas.
+        Usa el lector multihilo de pyarrow en lugar del parser de pandas.
         """
-        df = pd.read_csv(self.data_path)
+        table = pacsv.read_csv(self.data_path,
+                               read_options=pacsv.ReadOptions(use_threads=True))
+        # Columnas de texto como object para que preprocess las detecte como categóricas
+        df = table.to_pandas()
         print("Datos cargados (primeras 5 filas):")
         print(df.head())
         return df
@@ -35,8 +49,9 @@ class MLAgent:
     def preprocess(self, df):
         """
         Preprocesa los datos:
-        - Convierte categorías en variables dummy.
         - Llena valores faltantes con la mediana.
+        - Ajusta un ColumnTransformer que codifica categorías en one-hot; se conserva
+          en self.preprocessor para reutilizarlo en predict_risks sin recalcular el esquema.
         - Separa características (X) y etiquetas (y) si existen.
         """
         # Suponiendo que 'risk_label' es la columna objetivo (alto, medio, bajo)
@@ -45,20 +60,34 @@ class MLAgent:
 
         categorical_cols = df.select_dtypes(include=['object', 'category']).columns.tolist()
         categorical_cols = [col for col in categorical_cols if col != 'risk_label']
-        df = pd.get_dummies(df, columns=categorical_cols, drop_first=True)
+        self.preprocessor = ColumnTransformer(
+            [('oh', OneHotEncoder(handle_unknown='ignore', sparse_output=False), categorical_cols)],
+            remainder='passthrough'
+        )
 
-        X = df.drop('risk_label', axis=1)
+        # float32: los árboles de scikit-learn y cuML trabajan internamente en esa precisión
+        X = self.preprocessor.fit_transform(df.drop('risk_label', axis=1)).astype(np.float32)
         y = df['risk_label'].map({'bajo': 0, 'medio': 1, 'alto': 2})
         return X, y
 
-    def train_model(self, X, y):
+    def train_model(self, X, y, algorithm='random_forest'):
         """
-        Entrena un modelo de clasificación Random Forest para predecir niveles de riesgo.
+        Entrena un modelo de clasificación para predecir niveles de riesgo.
+        :param algorithm: 'random_forest' (en GPU con cuML si está instalado; si no, árboles
+                          en paralelo en todos los núcleos) o 'hist_gbdt' (Gradient Boosting con
+                          características discretizadas en histogramas).
         """
         X_train, X_test, y_train, y_test = train_test_split(X, y, 
                                                             test_size=0.3, 
                                                             random_state=42)
-        clf = RandomForestClassifier(n_estimators=100, random_state=42)
+        if algorithm == 'hist_gbdt':
+            clf = HistGradientBoostingClassifier(max_bins=255, random_state=42)
+        elif GPURandomForestClassifier is not None:
+            clf = GPURandomForestClassifier(n_estimators=100, random_state=42)
+            # cuML requiere etiquetas enteras de 32 bits
+            y_train = y_train.astype(np.int32)
+        else:
+            clf = RandomForestClassifier(n_estimators=100, n_jobs=-1, random_state=42)
         clf.fit(X_train, y_train)
 
         y_pred = clf.predict(X_test)
@@ -71,15 +100,15 @@ class MLAgent:
     def predict_risks(self, new_vuln_df):
         """
         Predice el nivel de riesgo para nuevas vulnerabilidades.
-        :param new_vuln_df: DataFrame con nuevas vulnerabilidades, mismas columnas que X.
+        :param new_vuln_df: DataFrame con nuevas vulnerabilidades, mismas columnas que el
+                            dataset histórico (sin 'risk_label').
         :return: DataFrame con predicciones y puntajes.
         """
-        X_new = pd.get_dummies(new_vuln_df)
-        # Alinea columnas con las usadas en entrenamiento
-        X_new = X_new.reindex(columns=self.model.feature_names_in_, fill_value=0)
+        # Reutiliza el esquema one-hot ajustado en preprocess; categorías nuevas se ignoran
+        X_new = self.preprocessor.transform(new_vuln_df).astype(np.float32)
 
         probs = self.model.predict_proba(X_new)
-        pred_labels = self.model.predict(X_new)
+        pred_labels = np.asarray(self.model.predict(X_new), dtype=np.int64)
 
         results = new_vuln_df.copy()
         results['predicted_risk'] = pred_labels
@@ -95,18 +124,25 @@ class MLAgent:
                                  Ej: {'alto': [('ControlA', 5), ('ControlB', 4)], ...}
         :return: DataFrame con controles priorizados.
         """
-        prioritized_list = []
-        for _, row in results_df.iterrows():
-            risk_level = ['bajo','medio','alto'][row['predicted_risk']]
-            prob = row['probability']
+        risk_levels = np.array(['bajo', 'medio', 'alto'])[results_df['predicted_risk'].to_numpy()]
+        probs = results_df['probability'].to_numpy()
+        prioritized_list = np.empty(len(results_df), dtype=object)
+
+        # Un cálculo vectorizado por nivel de riesgo en lugar de iterar fila por fila
+        for risk_level in np.unique(risk_levels):
+            rows = np.flatnonzero(risk_levels == risk_level)
             controls = controls_mapping.get(risk_level, [])
+            names = np.array([ctrl for ctrl, _ in controls], dtype=object)
+            impacts = np.array([impacto for _, impacto in controls], dtype=np.float64)
             # Calcular puntaje de control = probabilidad * impacto
-            scored = [(ctrl, prob * impacto) for ctrl, impacto in controls]
+            scores = probs[rows, None] * impacts
             # Orden descendente de puntaje
-            scored.sort(key=lambda x: x[1], reverse=True)
-            prioritized_list.append(scored)
+            order = np.argsort(-scores, axis=1, kind='stable')
+            scores = np.take_along_axis(scores, order, axis=1)
+            for row, idx, row_scores in zip(rows, order, scores):
+                prioritized_list[row] = list(zip(names[idx], row_scores.tolist()))
 
-        results_df['prioritized_controls'] = prioritized_list
+        results_df['prioritized_controls'] = list(prioritized_list)
         return results_df
 
 if __name__ == "__main__":
@@ -6,20 +6,58 @@
 # __________________________
 
 import boto3
+import time
 import datetime
+import threading
+import numba
 import pytz
-from collections import defaultdict
+from collections import defaultdict, deque
+from cachetools import TTLCache
+from cr_logging import get_logger
+
+logger = get_logger("agente_3")
+
+# Ubicaciones codificadas como enteros para el kernel compilado
+LOC_MEXICO_CITY = 0
+LOC_NEW_YORK = 1
+LOC_HEADQUARTERS = 2
+RISK_LEVELS = ('low', 'medium', 'high')
+
+@numba.njit(cache=True)
+def _risk_kernel(hour, loc_code, action_count):
+    """
+    Reglas de riesgo compiladas con Numba; retorna el índice en RISK_LEVELS.
+    La primera llamada compila y guarda el resultado en caché en disco.
+    """
+    risk = 0
+    # Riesgo alto si fuera del horario 8-18
+    if hour < 8 or hour > 18:
+        risk = 1
+    # Riesgo alto si ubicación no esperada
+    if loc_code != LOC_MEXICO_CITY and loc_code != LOC_HEADQUARTERS:
+        risk = 1
+    # Elevar a high si muchas acciones en corto tiempo
+    if action_count > 50:
+        risk = 2
+    return risk
 
 class DynamicIAMAgent:
-    ":""
+    """
     Un agente que monitoriza métricas de uso, contexto de ubicación y temporal,
     y ajusta políticas IAM de manera dinámica.
     """
-    def __init__(self, aws_region='us-east-1'):
+    def __init__(self, aws_region='us-east-1', history_size=1024, usage_window=300):
         # Cliente para interactuar con AWS IAM
         self.iam_client = boto3.client('iam', region_name=aws_region)
-        # Historial de accesos por usuario
-        self.usage_history = defaultdict(list)
+        # Historial de accesos por usuario: buffer circular acotado a `history_size` acciones
+        self.usage_history = defaultdict(lambda: deque(maxlen=history_size))
+        # Ventana deslizante (segundos) considerada para el conteo de acciones
+        self.usage_window_ns = usage_window * 1_000_000_000
+        # Caché por usuario de ARNs de políticas adjuntas, evita consultar IAM en cada ciclo
+        self._policy_cache = TTLCache(maxsize=10_000, ttl=300)
+        self._cache_lock = threading.Lock()
+        # Último nivel de riesgo aplicado por usuario
+        self._last_risk = {}
 
     def collect_context(self, user_id):
         """
@@ -37,10 +75,10 @@ class DynamicIAMAgent:
     def _mock_location(self, user_id):
         """
         Método placeholder para geolocalizar usuario.
-        Retorna una ciudad o región basada en el ID del usuario.
+        Retorna el código (LOC_*) de una ciudad o región basada en el ID del usuario.
         """
         # Alterna entre dos ubicaciones para demo
-        return 'Mexico_City' if int(user_id) % 2 == 0 else 'New_York'
+        return LOC_MEXICO_CITY if int(user_id) % 2 == 0 else LOC_NEW_YORK
 
     def evaluate_risk(self, context):
         """
@@ -53,18 +91,7 @@ class DynamicIAMAgent:
         hour = context['timestamp'].hour
         location = context['location']
         action_count = context['action_count']
-
-        risk = 'low'
-        # Riesgo alto si fuera del horario 8-18
-        if hour < 8 or hour > 18:
-            risk = 'medium'
-        # Riesgo alto si ubicación no esperada
-        if location not in ['Mexico_City', 'Headquarters']:
-            risk = 'medium'
-        # Elevar a high si muchas acciones en corto tiempo
-        if action_count > 50:
-            risk = 'high'
-        return risk
+        return RISK_LEVELS[_risk_kernel(hour, location, action_count)]
 
     def adjust_policies(self, user_id, risk_level):
         """
@@ -81,34 +108,71 @@ class DynamicIAMAgent:
         }
         target_policy = policy_map[risk_level]
 
-        # Paso de ejemplo: desadjuntar políticas previas y adjuntar la nueva
-        self._reset_policies(user_id)
-        self.iam_client.attach_user_policy(
-            UserName=user_id,
-            PolicyArn=target_policy
-        )
-        print(f"[{datetime.datetime.now()}] Usuario {user_id}: nivel de riesgo {risk_level}, política {target_policy} aplicada.")
+        # Sin cambio de riesgo y con caché vigente no hay nada que ajustar
+        with self._cache_lock:
+            unchanged = self._last_risk.get(user_id) == risk_level and user_id in self._policy_cache
+        if unchanged:
+            return
+
+        # Aplicar solo la diferencia entre políticas actuales y deseadas
+        changed = self._sync_policies(user_id, {target_policy})
+        with self._cache_lock:
+            self._last_risk[user_id] = risk_level
+        if changed:
+            logger.info({'event': 'policy_applied', 'user': user_id,
+                         'risk': risk_level, 'policy': target_policy})
 
-    def _reset_policies(self, user_id):
+    def _sync_policies(self, user_id, desired):
         """
-        Desadjunta todas las políticas administradas por AWS del usuario.
+        Desadjunta las políticas que sobran y adjunta las que faltan respecto a `desired`.
+        Retorna False si el usuario ya tenía exactamente las políticas deseadas.
         """
-        attached = self.iam_client.list_attached_user_policies(UserName=user_id)
-        for p in attached.get('AttachedPolicies', []):
+        current = set(self._attached_policies(user_id))
+        if current == desired:
+            return False
+        for arn in current - desired:
             self.iam_client.detach_user_policy(
                 UserName=user_id,
-                PolicyArn=p['PolicyArn']
+                PolicyArn=arn
+            )
+        for arn in desired - current:
+            self.iam_client.attach_user_policy(
+                UserName=user_id,
+                PolicyArn=arn
             )
+        with self._cache_lock:
+            self._policy_cache[user_id] = list(desired)
+        return True
+
+    def _attached_policies(self, user_id):
+        """
+        Devuelve los ARNs de políticas adjuntas al usuario, consultando IAM
+        solo cuando la caché no tiene una entrada vigente.
+        """
+        with self._cache_lock:
+            cached = self._policy_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+        attached = self.iam_client.list_attached_user_policies(UserName=user_id)
+        arns = [p['PolicyArn'] for p in attached.get('AttachedPolicies', [])]
+        with self._cache_lock:
+            self._policy_cache[user_id] = arns
+        return arns
 
     def record_usage(self, user_id, action):
         """
         Llama este método en cada evento de IAM (login, llamada API, etc.).
-        Guarda el tipo de acción para análisis de patrones.
+        Guarda el tipo de acción para análisis de patrones como tupla
+        (acción, marca de tiempo en ns desde epoch UTC) y descarta las acciones
+        que quedaron fuera de la ventana deslizante.
         """
-        self.usage_history[user_id].append({
-            'action': action,
-            'timestamp': datetime.datetime.now(pytz.UTC)
-        })
+        now = time.time_ns()
+        history = self.usage_history[user_id]
+        history.append((action, now))
+        cutoff = now - self.usage_window_ns
+        while history[0][1] < cutoff:
+            history.popleft()
 
     def run_cycle(self, user_id, action):
         """
@@ -3,9 +3,11 @@
 # y bloquean exfiltraciones mediante análisis de flujo de datos.
 # Explicación:
 # 1. watchdog: biblioteca usada para monitorear eventos de creación/modificación de archivos.
-# 2. Fernet (cryptography): ofrece cifrado simétrico con autenticidad y confidencialidad.
+# 2. AES-GCM (cryptography): cifrado simétrico autenticado; los archivos se cifran por bloques
+#    de 1 MiB en streaming, cada bloque con su propio nonce; el dato asociado es su índice y
+#    una marca de bloque final, de modo que truncar el archivo cifrado se detecta al descifrar.
 # 3. Cada vez que se detecta un archivo nuevo o modificado, se cifra, se etiqueta y se analiza.
-# 4. El etiquetado usa un fragmento de hash SHA-256 de la ruta para identificar archivos.
+# 4. El etiquetado usa un hash BLAKE2b corto (4 bytes) de la ruta para identificar archivos.
 # 5. El análisis de flujo simula reglas (ej. tamaño y horario) y retorna alerta si coincide.
 # 6. Si se detecta exfiltración, se bloquea eliminando el archivo original como respuesta inmediata.
 # 7. Puede extenderse con reenvío a sistemas SIEM o integración con DLP reales.
@@ -14,35 +16,128 @@
 import os
 import time
 import hashlib
+import functools
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cr_logging import get_logger
+
+logger = get_logger("agente_4")
+
+CHUNK_SIZE = 1 << 20  # Tamaño de bloque para cifrado en streaming (1 MiB)
+NONCE_SIZE = 12
+# Umbral de exfiltración sobre el tamaño cifrado. Antes se medía el token Fernet (base64,
+# ~4/3 del tamaño real) contra 1 000 000; AES-GCM apenas agrega 28 bytes por bloque,
+# así que se reescala para conservar el mismo umbral efectivo sobre los datos originales.
+EXFIL_SIZE_THRESHOLD = 750_000
+
+def _chunks(path, size=CHUNK_SIZE):
+    """Genera bloques de `size` bytes del archivo sin cargarlo completo en memoria"""
+    with open(path, 'rb') as f:
+        while chunk := f.read(size):
+            yield chunk
+
+def _chunk_aad(index, is_final):
+    """Dato asociado de cada bloque: índice (8 bytes) || marca de bloque final (1 byte)"""
+    return index.to_bytes(8, 'big') + (b'\x01' if is_final else b'\x00')
+
+def _encrypt_file(path, key):
+    """
+    Cifra `path` con AES-GCM por bloques y escribe `path`.enc como una secuencia de
+    (nonce || bloque cifrado || tag). El último bloque lleva la marca final en su dato
+    asociado; un archivo vacío produce un único bloque final vacío (autenticado).
+    Se ejecuta en un proceso trabajador para no bloquear el hilo de watchdog ni el GIL.
+    Retorna el tamaño cifrado.
+    """
+    aesgcm = AESGCM(key)
+    size = 0
+    with open(path + ".enc", 'wb') as out:
+        chunks = _chunks(path)
+        # Se lee un bloque por adelantado para saber cuál es el último
+        current = next(chunks, b'')
+        index = 0
+        while True:
+            following = next(chunks, None)
+            is_final = following is None
+            nonce = os.urandom(NONCE_SIZE)
+            block = nonce + aesgcm.encrypt(nonce, current, _chunk_aad(index, is_final))
+            out.write(block)
+            size += len(block)
+            if is_final:
+                break
+            current = following
+            index += 1
+    return size
 
 class DataLifecycleHandler(FileSystemEventHandler):
     """
     Manejador que responde a eventos en el sistema de archivos:
       - creación y modificación de archivos
       - dispara cifrado, etiquetado y análisis de flujo
+    Las ráfagas de eventos sobre una misma ruta (p. ej. un editor guardando) se agrupan:
+    solo el último evento tras `debounce` segundos de calma procesa el archivo.
     """
-    def __init__(self, agent):
+    def __init__(self, agent, debounce=0.5):
         self.agent = agent
+        self.debounce = debounce
+        self._pending = {}  # ruta -> threading.Timer pendiente
+        self._lock = threading.Lock()
+        self._stopped = False  # tras stop() ningún temporizador llega al pool
 
     def on_created(self, event):
         if not event.is_directory:
-            self.agent.process_file(event.src_path)
+            self._schedule(event.src_path)
 
     def on_modified(self, event):
         if not event.is_directory:
-            self.agent.process_file(event.src_path)
+            self._schedule(event.src_path)
+
+    def _schedule(self, path):
+        """Reprograma el procesamiento de `path`, cancelando el temporizador previo"""
+        timer = threading.Timer(self.debounce, self._fire)
+        timer.args = (path, timer)
+        timer.daemon = True
+        with self._lock:
+            if self._stopped:
+                return
+            previous = self._pending.get(path)
+            if previous is not None:
+                previous.cancel()
+            self._pending[path] = timer
+        timer.start()
+
+    def _fire(self, path, timer):
+        with self._lock:
+            # Solo se retira si sigue siendo el temporizador vigente: uno más reciente
+            # registrado mientras este se disparaba debe seguir pudiendo cancelarse
+            if self._pending.get(path) is timer:
+                del self._pending[path]
+            # El envío ocurre bajo el candado para que stop() no pueda cerrar el pool
+            # entre la comprobación y el submit
+            if self._stopped:
+                return
+            self.agent.process_file(path)
+
+    def stop(self):
+        """Cancela los temporizadores pendientes; debe llamarse antes de cerrar el pool"""
+        with self._lock:
+            self._stopped = True
+            for timer in self._pending.values():
+                timer.cancel()
+            self._pending.clear()
 
 class IntelligentAgent:
     def __init__(self, watch_dir, key=None):
         # Directorio a monitorear y clave de cifrado
         self.watch_dir = watch_dir
-        self.key = key or Fernet.generate_key()
-        self.cipher = Fernet(self.key)
+        self.key = key or AESGCM.generate_key(bit_length=256)
+        self.cipher = AESGCM(self.key)
         # Diccionario para etiquetas de archivos
         self.labels = {}
+        # Procesos trabajadores para el cifrado (intensivo en CPU)
+        self._pool = ProcessPoolExecutor(max_workers=os.cpu_count())
 
     def start(self):
         """Inicia el observador de filesystem"""
@@ -50,68 +145,71 @@ class IntelligentAgent:
         observer = Observer()
         observer.schedule(event_handler, self.watch_dir, recursive=True)
         observer.start()
-        print(f"[+] Agente iniciado. Monitoreando: {self.watch_dir}")
+        logger.info({'event': 'agent_started', 'watch_dir': self.watch_dir})
         try:
             while True:
                 time.sleep(1)
         except KeyboardInterrupt:
             observer.stop()
         observer.join()
+        event_handler.stop()
+        self._pool.shutdown()
 
     def process_file(self, path):
-        """Procesa cada archivo: cifrado, etiquetado y análisis de flujo"""
-        print(f"[*] Detectado cambio: {path}")
-        data = self._read_file(path)
-        encrypted = self.encrypt_data(data)
-        self._write_file(path + ".enc", encrypted)
+        """
+        Procesa cada archivo: el cifrado se envía al pool de procesos y el
+        etiquetado y análisis de flujo continúan al terminar, sin bloquear a watchdog.
+        """
+        logger.info({'event': 'change_detected', 'path': path})
+        future = self._pool.submit(_encrypt_file, path, self.key)
+        future.add_done_callback(functools.partial(self._on_encrypted, path))
+
+    def _on_encrypted(self, path, future):
+        """Completa etiquetado y análisis de flujo una vez cifrado el archivo"""
+        try:
+            encrypted_size = future.result()
+        except Exception as e:
+            logger.error({'event': 'encrypt_failed', 'path': path, 'error': str(e)})
+            return
         label = self.label_data(path)
-        print(f"    Etiqueta asignada: {label}")
-        if self.analyze_flow(path, encrypted):
+        logger.info({'event': 'encrypted', 'path': path, 'size': encrypted_size, 'label': label})
+        if self.analyze_flow(path, encrypted_size):
             self.block_exfiltration(path)
 
-    def _read_file(self, path):
-        with open(path, 'rb') as f:
-            return f.read()
-
-    def _write_file(self, path, data):
-        with open(path, 'wb') as f:
-            f.write(data)
-
     def encrypt_data(self, data):
-        """Aplica cifrado simétrico con Fernet"""
-        token = self.cipher.encrypt(data)
-        print("    [Cifrado] Datos cifrados correctamente en memoria")
+        """Aplica cifrado simétrico autenticado con AES-GCM (nonce || datos cifrados || tag)"""
+        nonce = os.urandom(NONCE_SIZE)
+        token = nonce + self.cipher.encrypt(nonce, data, None)
+        logger.info({'event': 'encrypted_in_memory', 'size': len(token)})
         return token
 
     def label_data(self, path):
         """Genera etiqueta en base a hash y ruta"""
-        hasher = hashlib.sha256()
-        hasher.update(path.encode())
-        tag = hasher.hexdigest()[:8]
+        tag = hashlib.blake2b(path.encode(), digest_size=4).hexdigest()
         self.labels[path] = tag
         return tag
 
-    def analyze_flow(self, path, encrypted_data):
+    def analyze_flow(self, path, size):
         """
         Simula análisis de flujo de datos buscando patrones sospechosos.
+        :param size: tamaño en bytes de los datos cifrados.
         Retorna True si detecta posible exfiltración.
         """
-        size = len(encrypted_data)
         # Ejemplo de regla: archivos grandes modificados fuera de horario laboral
         hour = time.localtime().tm_hour
-        if size > 1_000_000 and (hour < 8 or hour > 18):
-            print("    [Alerta] Flujo de datos sospechoso detectado")
+        if size > EXFIL_SIZE_THRESHOLD and (hour < 8 or hour > 18):
+            logger.warning({'event': 'suspicious_flow', 'path': path, 'size': size, 'hour': hour})
             return True
-        print("    [Análisis] Flujo de datos normal")
+        logger.info({'event': 'normal_flow', 'path': path, 'size': size})
         return False
 
     def block_exfiltration(self, path):
         """Bloquea la exfiltración eliminando el archivo original como medida retractiva"""
         try:
             os.remove(path)
-            print(f"    [Bloqueo] Archivo original {path} ha sido eliminado")
+            logger.warning({'event': 'exfiltration_blocked', 'path': path})
         except Exception as e:
-            print(f"    [Error] No se pudo bloquear exfiltración: {e}")
+            logger.error({'event': 'block_failed', 'path': path, 'error': str(e)})
 
 if __name__ == "__main__":
     # Ejemplo de uso: ajustar ruta a monitorear
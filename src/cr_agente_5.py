@@ -7,6 +7,7 @@
 """
 Sistema de Detección de Ataques Avanzados mediante Autoencoders y Clustering
 """
+import weakref
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -16,16 +17,25 @@ from sklearn.ensemble import IsolationForest
 from sklearn.decomposition import PCA
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, silhouette_score
+import tensorflow as tf
+from tensorflow.keras import mixed_precision
 from tensorflow.keras.models import Model, Sequential
 from tensorflow.keras.layers import Dense, Input, Dropout
 from tensorflow.keras.callbacks import EarlyStopping
 import seaborn as sns
+from cr_logging import get_logger
+
+logger = get_logger("agente_5")
 
 # Configuración de visualización
 plt.style.use('ggplot')
 plt.rcParams['figure.figsize'] = (12, 6)
 np.random.seed(42)
 
+# Precisión mixta solo con GPU (Tensor Cores); en CPU se mantiene float32
+if tf.config.list_physical_devices('GPU'):
+    mixed_precision.set_global_policy('mixed_float16')
+
 # 1. Generación de datos sintéticos de logs y tráfico de red
 def generar_datos_sinteticos(n_muestras=10000, ratio_anomalias=0.05):
     """
@@ -51,30 +61,42 @@ def generar_datos_sinteticos(n_muestras=10000, ratio_anomalias=0.05):
     
     # Tipos de ataques (0=normal, 1-5=tipos de ataque)
     df['tipo_ataque'] = 0
+    tipos = np.random.choice([1, 2, 3, 4, 5], size=n_anomalias)
+    df.loc[indices_ataque, 'tipo_ataque'] = tipos
+    
+    # Patrones de ataque específicos (una operación vectorizada por tipo)
+    # DDoS
+    idx = indices_ataque[tipos == 1]
+    df.loc[idx, 'bytes_rec'] *= 50
+    df.loc[idx, 'paquetes'] = np.random.randint(500, 1000, size=len(idx))
+    df.loc[idx, 'frecuencia'] *= 10
+    # Exfiltración
+    idx = indices_ataque[tipos == 2]
+    df.loc[idx, 'bytes_env'] *= 100
+    df.loc[idx, 'duracion'] = np.random.uniform(10, 30, size=len(idx))
+    # Escaneo
+    idx = indices_ataque[tipos == 3]
+    df.loc[idx, 'paquetes'] = np.random.randint(300, 600, size=len(idx))
+    df.loc[idx, 'protocolo'] = 2
+    # Comando remoto
+    idx = indices_ataque[tipos == 4]
+    df.loc[idx, 'frecuencia'] *= 20
+    df.loc[idx, 'duracion'] = np.random.uniform(5, 15, size=len(idx))
+    # Ataque sigiloso
+    idx = indices_ataque[tipos == 5]
+    df.loc[idx, ['bytes_rec', 'bytes_env']] *= 0.1
+    df.loc[idx, 'frecuencia'] *= 0.05
     
-    # Patrones de ataque específicos
-    for i in indices_ataque:
-        tipo_ataque = np.random.choice([1, 2, 3, 4, 5])
-        df.at[i, 'tipo_ataque'] = tipo_ataque
-        
-        # Modificar características según tipo de ataque
-        if tipo_ataque == 1:  # DDoS
-            df.at[i, 'bytes_rec'] *= 50
-            df.at[i, 'paquetes'] = np.random.randint(500, 1000)
-            df.at[i, 'frecuencia'] *= 10
-        elif tipo_ataque == 2:  # Exfiltración
-            df.at[i, 'bytes_env'] *= 100
-            df.at[i, 'duracion'] = np.random.uniform(10, 30)
-        elif tipo_ataque == 3:  # Escaneo
-            df.at[i, 'paquetes'] = np.random.randint(300, 600)
-            df.at[i, 'protocolo'] = 2
-        elif tipo_ataque == 4:  # Comando remoto
-            df.at[i, 'frecuencia'] *= 20
-            df.at[i, 'duracion'] = np.random.uniform(5, 15)
-        elif tipo_ataque == 5:  # Ataque sigiloso
-            df.at[i, 'bytes_rec'] *= 0.1
-            df.at[i, 'bytes_env'] *= 0.1
-            df.at[i, 'frecuencia'] *= 0.05
+    # Tipos compactos: reducen la huella en memoria de cada pasada posterior
+    df = df.astype({
+        'duracion': np.float32,
+        'bytes_env': np.float32,
+        'bytes_rec': np.float32,
+        'paquetes': np.uint16,
+        'protocolo': np.int8,
+        'frecuencia': np.float32,
+        'tipo_ataque': np.uint8
+    })
     
     return df
 
@@ -84,11 +106,16 @@ def preprocesar_datos(df):
     Preprocesa los datos: normalización, codificación y preparación de características
     """
     # Separar características y etiquetas
-    X = df.drop('tipo_ataque', axis=1)
-    y = df['tipo_ataque']
+    # Matriz float32 en orden columna (Fortran): cada característica queda contigua
+    # y se copia una sola vez desde su columna, sin pasar por un DataFrame intermedio
+    columnas = [c for c in df.columns if c != 'tipo_ataque']
+    X = np.empty((len(df), len(columnas)), dtype=np.float32, order='F')
+    for j, columna in enumerate(columnas):
+        X[:, j] = df[columna].to_numpy()
+    y = df['tipo_ataque'].astype(np.int8)
     
-    # Normalización de características numéricas
-    scaler = StandardScaler()
+    # Normalización de características numéricas (en el mismo arreglo)
+    scaler = StandardScaler(copy=False)
     X_scaled = scaler.fit_transform(X)
     
     return X_scaled, y, scaler
@@ -111,7 +138,8 @@ def construir_autoencoder(n_caracteristicas):
     decoder = Dropout(0.2)(decoder)
     decoder = Dense(32, activation='relu')(decoder)
     decoder = Dropout(0.2)(decoder)
-    output_layer = Dense(n_caracteristicas, activation='linear')(decoder)
+    # Salida en float32 para que la pérdida sea estable con precisión mixta
+    output_layer = Dense(n_caracteristicas, activation='linear', dtype='float32')(decoder)
     
     # Modelo completo
     autoencoder = Model(inputs=input_layer, outputs=output_layer)
@@ -120,19 +148,48 @@ def construir_autoencoder(n_caracteristicas):
     autoencoder.compile(optimizer='adam', loss='mse')
     return autoencoder, encoder_model
 
+# Función de inferencia trazada por modelo: se construye una sola vez y se reutiliza
+_pasos_inferencia = weakref.WeakKeyDictionary()
+
+def _paso_inferencia(modelo, n_features):
+    """Devuelve (creándola la primera vez) la tf.function de inferencia del modelo"""
+    paso = _pasos_inferencia.get(modelo)
+    if paso is None:
+        # Referencia débil: la función guardada no debe mantener vivo al modelo (llave del caché)
+        ref_modelo = weakref.ref(modelo)
+        paso = tf.function(
+            lambda x: ref_modelo()(x, training=False),
+            input_signature=[tf.TensorSpec([None, n_features], tf.float32)]
+        )
+        _pasos_inferencia[modelo] = paso
+    return paso
+
+def inferir(modelo, X, tam_lote=8192):
+    """
+    Inferencia directa con el modelo trazado como tf.function, evitando el pipeline
+    de predict() (callbacks, barra de progreso, bucle de lotes de Keras)
+    """
+    paso = _paso_inferencia(modelo, X.shape[1])
+    salidas = [paso(tf.constant(X[i:i + tam_lote], dtype=tf.float32)).numpy()
+               for i in range(0, len(X), tam_lote)]
+    return np.concatenate(salidas)
+
 # 4. Clustering para correlación de eventos
 def detectar_patrones_ocultos(representaciones, eps=0.5, min_samples=5):
     """
     Detecta patrones ocultos usando DBSCAN para agrupar eventos dispersos
     """
-    clustering = DBSCAN(eps=eps, min_samples=min_samples).fit(representaciones)
+    # Búsqueda de vecindades con ball tree en todos los núcleos
+    clustering = DBSCAN(eps=eps, min_samples=min_samples, algorithm='ball_tree',
+                        leaf_size=40, n_jobs=-1).fit(representaciones)
     etiquetas = clustering.labels_
     return etiquetas
 
 # 5. Visualización de resultados
-def visualizar_resultados(X, errores, etiquetas_cluster, y_real, umbral):
+def visualizar_resultados(X, errores, etiquetas_cluster, y_real, umbral, pca=None):
     """
     Visualiza los resultados de detección y clustering
+    pca: proyección PCA ya ajustada (p. ej. sobre el entrenamiento); si es None se ajusta sobre X
     """
     # Visualización de errores de reconstrucción
     plt.figure(figsize=(14, 6))
@@ -145,8 +202,9 @@ def visualizar_resultados(X, errores, etiquetas_cluster, y_real, umbral):
     plt.legend()
     
     # Visualización de clusters (usando PCA para reducción dimensional)
-    pca = PCA(n_components=2)
-    componentes = pca.fit_transform(X)
+    if pca is None:
+        pca = PCA(n_components=2, svd_solver='randomized', random_state=42).fit(X)
+    componentes = pca.transform(X)
     
     plt.subplot(1, 2, 2)
     scatter = plt.scatter(
@@ -179,38 +237,59 @@ def visualizar_resultados(X, errores, etiquetas_cluster, y_real, umbral):
 # --- Pipeline Principal ---
 if __name__ == "__main__":
     # Paso 1: Generar datos sintéticos
-    print("Generando datos sintéticos...")
+    logger.info({'event': 'stage', 'stage': 'generate_data'})
     df = generar_datos_sinteticos(n_muestras=15000, ratio_anomalias=0.07)
     
     # Paso 2: Preprocesamiento
-    print("Preprocesando datos...")
+    logger.info({'event': 'stage', 'stage': 'preprocess'})
     X, y, scaler = preprocesar_datos(df)
     
     # Paso 3: Entrenar Autoencoder
-    print("Construyendo y entrenando autoencoder...")
+    logger.info({'event': 'stage', 'stage': 'train_autoencoder'})
     autoencoder, encoder = construir_autoencoder(X.shape[1])
     
     # Dividir datos (solo datos normales para entrenamiento)
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=0.3, random_state=42
     )
-    X_train_normal = X_train[y_train == 0]
+    X_train_normal = X_train[y_train.to_numpy() == 0]
+    
+    # Separar validación una sola vez (último 15%, igual que validation_split)
+    n_val = int(len(X_train_normal) * 0.15)
+    n_fit = len(X_train_normal) - n_val  # [:-n_val] quedaría vacío si n_val == 0
+    X_fit, X_val = X_train_normal[:n_fit], X_train_normal[n_fit:]
+    
+    # Lote de hasta 4096, pero con al menos ~32 pasos de optimización por época:
+    # con pocos datos normales un lote fijo de 4096 daría 1-2 pasos y subentrenaría
+    tam_lote = int(np.clip(n_fit // 32, 256, 4096))
+    
+    # Pipelines tf.data en caché: el conjunto cabe en memoria y se reutiliza en cada época
+    train_ds = (tf.data.Dataset.from_tensor_slices((X_fit, X_fit))
+                .cache()
+                .shuffle(8192)
+                .batch(tam_lote)
+                .prefetch(tf.data.AUTOTUNE))
+    val_ds = (tf.data.Dataset.from_tensor_slices((X_val, X_val))
+              .batch(tam_lote)
+              .cache()
+              .prefetch(tf.data.AUTOTUNE))
     
     # Entrenamiento
     early_stop = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)
     historia = autoencoder.fit(
-        X_train_normal, X_train_normal,
+        train_ds,
+        validation_data=val_ds,
         epochs=100,
-        batch_size=128,
-        validation_split=0.15,
         callbacks=[early_stop],
         verbose=1
     )
     
     # Paso 4: Detección de anomalías
-    print("Detectando anomalías...")
-    reconstrucciones = autoencoder.predict(X_test)
-    errores = np.mean(np.square(X_test - reconstrucciones), axis=1)
+    logger.info({'event': 'stage', 'stage': 'detect_anomalies'})
+    reconstrucciones = inferir(autoencoder, X_test)
+    # MSE por fila: una sola resta y reducción fusionada con einsum (sin temporal del cuadrado)
+    residuo = X_test - reconstrucciones
+    errores = np.einsum('ij,ij->i', residuo, residuo) / residuo.shape[1]
     
     # Calcular umbral dinámico (percentil 95)
     umbral = np.percentile(errores, 95)
@@ -222,11 +301,11 @@ if __name__ == "__main__":
     print(classification_report(y_test_bin, anomalias))
     
     # Paso 5: Extraer representaciones latentes
-    print("Extrayendo representaciones latentes...")
-    representaciones = encoder.predict(X_test)
+    logger.info({'event': 'stage', 'stage': 'extract_latent'})
+    representaciones = inferir(encoder, X_test)
     
     # Paso 6: Detectar patrones ocultos con clustering
-    print("Detectando patrones ocultos con DBSCAN...")
+    logger.info({'event': 'stage', 'stage': 'cluster_dbscan'})
     etiquetas_cluster = detectar_patrones_ocultos(representaciones, eps=0.8, min_samples=3)
     
     # Identificar clusters relacionados con ataques
@@ -239,20 +318,30 @@ if __name__ == "__main__":
         if ratio_ataque > 0.7:  # Clusters con >70% de ataques
             cluster_ataque.append(cluster_id)
     
-    print(f"\nClusters maliciosos detectados: {cluster_ataque}")
+    logger.info({'event': 'malicious_clusters', 'clusters': [int(c) for c in cluster_ataque]})
     
     # Paso 7: Visualización
-    print("Visualizando resultados...")
-    visualizar_resultados(X_test, errores, etiquetas_cluster, y_test, umbral)
+    logger.info({'event': 'stage', 'stage': 'visualize'})
+    # Proyección ajustada una sola vez sobre el tráfico normal de entrenamiento
+    pca = PCA(n_components=2, svd_solver='randomized', random_state=42).fit(X_train_normal)
+    visualizar_resultados(X_test, errores, etiquetas_cluster, y_test, umbral, pca=pca)
     
     # Paso 8: Sistema integrado de alerta
     print("\nSistema de Alerta Integrado:")
-    for i in np.where(anomalias)[0]:
-        cluster_id = etiquetas_cluster[i]
-        tipo_ataque = y_test.iloc[i]
-        if cluster_id in cluster_ataque:
-            print(f"[ALERTA CRÍTICA] Evento {i} - Cluster {cluster_id}: "
-                  f"Ataque de tipo {tipo_ataque} (Confianza: {errores[i]:.2f})")
-        elif anomalias[i]:
-            print(f"[ALERTA] Evento {i}: Comportamiento anómalo detectado "
-                  f"(Error: {errores[i]:.2f})")
\ No newline at end of file
+    # Arreglos seleccionados una sola vez; sin indexación pandas dentro del bucle
+    idx_anomalias = np.flatnonzero(anomalias)
+    clusters = etiquetas_cluster[idx_anomalias]
+    tipos = y_test.to_numpy()[idx_anomalias]
+    errores_anomalias = errores[idx_anomalias]
+    es_critica = np.isin(clusters, cluster_ataque)
+    alertas = [
+        f"[ALERTA CRÍTICA] Evento {i} - Cluster {cluster_id}: "
+        f"Ataque de tipo {tipo_ataque} (Confianza: {error:.2f})"
+        if critica else
+        f"[ALERTA] Evento {i}: Comportamiento anómalo detectado "
+        f"(Error: {error:.2f})"
+        for i, cluster_id, tipo_ataque, error, critica
+        in zip(idx_anomalias, clusters, tipos, errores_anomalias, es_critica)
+    ]
+    if alertas:
+        print("\n".join(alertas))
@@ -4,9 +4,40 @@
 # oswaldo.diaz@inegi.org.mx
 # _____________________________
 import asyncio
+import itertools
 import random
 import time
 from datetime import datetime
+import numpy as np
+import aiohttp
+from cr_logging import get_logger
+
+logger = get_logger("agente_6")
+# Secuencia monótona para trazar los IOC dentro del pipeline sin consultar el reloj por elemento
+_seq = itertools.count()
+
+async def drain(queue, max_batch=128):
+    """
+    Espera al menos un elemento y luego extrae sin bloquear los que ya estén
+    disponibles, hasta `max_batch`, para procesarlos en lote.
+    """
+    items = [await queue.get()]
+    try:
+        while len(items) < max_batch:
+            items.append(queue.get_nowait())
+    except asyncio.QueueEmpty:
+        pass
+    return items
+
+def put_many(queue, items):
+    """Encola un lote en una cola sin límite de tamaño, sin ceder el control por elemento."""
+    for item in items:
+        queue.put_nowait(item)
+
+def task_done_many(queue, count):
+    """Marca como procesados `count` elementos extraídos de la cola."""
+    for _ in range(count):
+        queue.task_done()
 
 class FeedIntegrationAgent:
     """
@@ -15,11 +46,21 @@ class FeedIntegrationAgent:
     """
     def __init__(self, feed_sources):
         self.feed_sources = feed_sources
+        # Sesión HTTP compartida (pool de conexiones); se crea dentro del event loop en run()
+        self.session = None
 
     async def fetch_feed(self, source):
+        if source.startswith(('http://', 'https://')):
+            # Feed real: se espera una lista JSON de IOC con el formato crudo
+            async with self.session.get(source) as resp:
+                resp.raise_for_status()
+                events = await resp.json()
+            logger.info({'event': 'feed_collected', 'source': source, 'count': len(events)})
+            return events
+
         # Simula llamada a API o lectura de feed
         await asyncio.sleep(random.uniform(0.5, 1.5))
-        print(f"[{datetime.now()}] Recolectado feed desde {source}")
+        logger.info({'event': 'feed_collected', 'source': source})
         # Datos crudos simulados
         return [{
             'ioc': random.choice(['192.168.1.10', 'malware.exe', 'evil.com']),
@@ -29,13 +70,24 @@ class FeedIntegrationAgent:
         } for _ in range(random.randint(1, 3))]
 
     async def run(self, output_queue):
-        while True:
-            for source in self.feed_sources:
-                events = await self.fetch_feed(source)
-                for evt in events:
-                    await output_queue.put(evt)
-            # Intervalo de polling
-            await asyncio.sleep(5)
+        connector = aiohttp.TCPConnector(limit=100, ttl_dns_cache=300)
+        # Límite por petición: un feed lento no debe retrasar indefinidamente el ciclo
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            self.session = session
+            while True:
+                # Todas las fuentes se consultan en paralelo: latencia máx(RTT) en lugar de N·RTT
+                # Un feed que falla (HTTP, timeout, DNS) se registra y no detiene a los demás
+                batches = await asyncio.gather(*(self.fetch_feed(source) for source in self.feed_sources),
+                                               return_exceptions=True)
+                for source, events in zip(self.feed_sources, batches):
+                    if isinstance(events, Exception):
+                        logger.error({'event': 'feed_failed', 'source': source,
+                                      'error': f"{type(events).__name__}: {events}"})
+                        continue
+                    put_many(output_queue, events)
+                # Intervalo de polling
+                await asyncio.sleep(5)
 
 class ThreatNormalizationAgent:
     """
@@ -45,23 +97,29 @@ class ThreatNormalizationAgent:
     def __init__(self):
         pass
 
-    async def normalize(self, raw_ioc):
+    def normalize(self, raw_iocs):
+        """
+        Normaliza un lote de IOC crudos (función síncrona: no hay E/S).
+        La severidad se escala de forma vectorizada para todo el lote.
+        """
         # Simula normalización: estandarizar claves, formatos, etc.
-        normalized = {
+        scores = np.fromiter((r['raw_severity'] for r in raw_iocs),
+                             dtype=np.float64, count=len(raw_iocs)) / 10.0
+        normalized = [{
             'indicator': raw_ioc['ioc'],
             'category': raw_ioc['type'],
-            'severity_score': raw_ioc['raw_severity'] / 10.0,
+            'severity_score': score,
             'observed_at': raw_ioc['timestamp']
-        }
-        print(f"[{datetime.now()}] Normalizado IOC: {normalized['indicator']}")
+        } for raw_ioc, score in zip(raw_iocs, scores.tolist())]
+        for norm in normalized:
+            logger.info({'event': 'ioc_normalized', 'seq': next(_seq), 'indicator': norm['indicator']})
         return normalized
 
     async def run(self, input_queue, output_queue):
         while True:
-            raw = await input_queue.get()
-            norm = await self.normalize(raw)
-            await output_queue.put(norm)
-            input_queue.task_done()
+            batch = await drain(input_queue)
+            put_many(output_queue, self.normalize(batch))
+            task_done_many(input_queue, len(batch))
 
 class PrioritizationAgent:
     """
@@ -70,19 +128,25 @@ class PrioritizationAgent:
     def __init__(self, threshold=0.5):
         self.threshold = threshold
 
-    async def prioritize(self, normalized_ioc):
+    def prioritize(self, normalized_iocs):
+        """
+        Asigna prioridad a un lote de IOC normalizados (función síncrona: no hay E/S).
+        """
         # Agrega lógica de priorización: puede combinar scoring, reglas, ML, etc.
-        priority = 'alta' if normalized_ioc['severity_score'] >= self.threshold else 'media'
-        normalized_ioc['priority'] = priority
-        print(f"[{datetime.now()}] Prioridad asignada ({priority}) a {normalized_ioc['indicator']}")
-        return normalized_ioc
+        scores = np.fromiter((n['severity_score'] for n in normalized_iocs),
+                             dtype=np.float64, count=len(normalized_iocs))
+        priorities = np.where(scores >= self.threshold, 'alta', 'media').tolist()
+        for normalized_ioc, priority in zip(normalized_iocs, priorities):
+            normalized_ioc['priority'] = priority
+            logger.info({'event': 'ioc_prioritized', 'seq': next(_seq),
+                         'indicator': normalized_ioc['indicator'], 'priority': priority})
+        return normalized_iocs
 
     async def run(self, input_queue, output_queue):
         while True:
-            norm = await input_queue.get()
-            prio = await self.prioritize(norm)
-            await output_queue.put(prio)
-            input_queue.task_done()
+            batch = await drain(input_queue)
+            put_many(output_queue, self.prioritize(batch))
+            task_done_many(input_queue, len(batch))
 
 class AlertAgent:
     """
@@ -93,15 +157,15 @@ class AlertAgent:
 
     async def emit_alert(self, prio_ioc):
         # Aquí podría integrarse con WebSocket, correo, SIEM, etc.
-        alert = (f"ALERTA [{datetime.now()}]: Indicador {prio_ioc['indicator']} "
-                 f"de categoría {prio_ioc['category']} con prioridad {prio_ioc['priority']}")
-        print(alert)
+        logger.warning({'event': 'alert', 'seq': next(_seq), 'indicator': prio_ioc['indicator'],
+                        'category': prio_ioc['category'], 'priority': prio_ioc['priority']})
 
     async def run(self, input_queue):
         while True:
-            ioc = await input_queue.get()
-            await self.emit_alert(ioc)
-            input_queue.task_done()
+            batch = await drain(input_queue)
+            for ioc in batch:
+                await self.emit_alert(ioc)
+            task_done_many(input_queue, len(batch))
 
 async def main():
     # Definición de canales (colas) asincrónicas para comunicación entre agentes
@@ -9,7 +9,7 @@
 # 3. block_ip():
 #    - Simula bloqueo local, reemplazar con comandos de UFW, iptables o APIs de cloud.
 # 4. generate_report():
-#    - Usa pandas para estructurar datos de incidentes y exportar a CSV.
+#    - Escribe los incidentes a CSV en streaming con csv.DictWriter (biblioteca estándar).
 # 5. notify_stakeholders():
 #    - Envía emails con SMTP, adjuntando el CSV generado.
 #      Las credenciales se cargan de variables de entorno para seguridad.
@@ -21,11 +21,12 @@
 # oswaldo.diaz@inegi.org.mx
 # --------------------------------------------
 import os
+import csv
 import logging
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-import pandas as pd
+from email.mime.application import MIMEApplication
 import datetime
 
 # Configure logging for the agent
@@ -73,11 +74,13 @@ class RPAAgent:
         Retorna la ruta al archivo generado.
         """
         logging.info("Generando informe inicial de incidentes...")
-        df = pd.DataFrame(incidents)
         timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"report_{timestamp}.csv"
         filepath = os.path.join(self.report_dir, filename)
-        df.to_csv(filepath, index=False)
+        with open(filepath, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['timestamp', 'host', 'ip', 'action'])
+            writer.writeheader()
+            writer.writerows(incidents)
         logging.info(f"Informe generado: {filepath}")
         return filepath
 
@@ -102,25 +105,25 @@ class RPAAgent:
         # Construcción del mensaje
         msg = MIMEMultipart()
         msg['From'] = user
+        # Destinatarios solo en el sobre SMTP (equivalente a BCC): ninguno ve a los demás
+        msg['To'] = user
         msg['Subject'] = "[Automático] Informe de Incidentes de Ciberseguridad"
         body = f"Adjunto encuentras el informe inicial generado automáticamente: {os.path.basename(report_path)}"
         msg.attach(MIMEText(body, 'plain'))
 
-        # Adjuntar el archivo CSV
-        with open(report_path, 'r') as f:
-            attachment = MIMEText(f.read(), 'csv')
+        # Adjuntar el archivo CSV (leído como bytes, codificado en base64 por la librería)
+        with open(report_path, 'rb') as f:
+            attachment = MIMEApplication(f.read(), _subtype='csv')
             attachment.add_header('Content-Disposition', 'attachment', filename=os.path.basename(report_path))
             msg.attach(attachment)
 
         try:
-            smtp = smtplib.SMTP(server, int(port))
-            smtp.starttls()
-            smtp.login(user, password)
-            for recipient in stakeholders:
-                msg['To'] = recipient
-                smtp.sendmail(user, recipient, msg.as_string())
-                logging.info(f"Notificación enviada a: {recipient}")
-            smtp.quit()
+            # Un solo mensaje serializado y enviado una vez a todos los destinatarios
+            with smtplib.SMTP(server, int(port)) as smtp:
+                smtp.starttls()
+                smtp.login(user, password)
+                smtp.send_message(msg, from_addr=user, to_addrs=stakeholders)
+            logging.info(f"Notificación enviada a: {', '.join(stakeholders)}")
             logging.info("Todas las notificaciones se enviaron correctamente.")
         except Exception as e:
             logging.error(f"Error al enviar notificaciones: {e}")
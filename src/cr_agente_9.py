@@ -4,24 +4,223 @@
 # oswaldo.diaz@inegi.org.mx
 # _____________________________
 import os
+import errno
+import asyncio
+import functools
 import hashlib
 import json
-import time
+import logging
+import mmap
+import shelve
 import shutil
+import tempfile
 from datetime import datetime
 import threading
 import queue
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+from cr_logging import get_logger
+try:
+    # Event loop de libuv (menor costo por callback que el selector por defecto)
+    import uvloop
+    new_event_loop = uvloop.new_event_loop
+except ImportError:
+    new_event_loop = asyncio.new_event_loop
+try:
+    # BLAKE3 con SIMD y varios hilos por archivo (opcional)
+    import blake3
+except ImportError:
+    blake3 = None
+try:
+    # ioctl de clonación (reflink) para restauraciones; no existe fuera de POSIX
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl FICLONE de Linux (_IOW(0x94, 9, int)): clona el archivo compartiendo extents (CoW)
+FICLONE = 0x40049409
+
+# Errores que indican "método no disponible aquí" (y no una falla real de E/S como ENOSPC o EIO)
+_COPY_FALLBACK_ERRNOS = frozenset(
+    getattr(errno, name) for name in ("ENOTSUP", "EOPNOTSUPP", "EXDEV", "EINVAL", "ENOSYS", "ENOTTY")
+    if hasattr(errno, name)
+)
+
+def _kernel_copy(copy_fn, fsrc, fdst, remaining):
+    """Repite la copia en kernel hasta agotar el archivo; propaga OSError/AttributeError"""
+    while remaining > 0:
+        copied = copy_fn(fdst.fileno(), fsrc.fileno(), remaining)
+        if copied == 0:
+            break
+        remaining -= copied
+
+def _copy_data(fsrc, fdst):
+    """Copia el contenido con el método más rápido disponible entre archivos abiertos"""
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError as e:
+            if e.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+    size = os.fstat(fsrc.fileno()).st_size
+    strategies = (
+        lambda out_fd, in_fd, count: os.copy_file_range(in_fd, out_fd, count),
+        lambda out_fd, in_fd, count: os.sendfile(out_fd, in_fd, None, count),
+    )
+    for copy_fn in strategies:
+        try:
+            _kernel_copy(copy_fn, fsrc, fdst, size)
+            return
+        except AttributeError:
+            pass
+        except OSError as e:
+            if e.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+        # Reinicia el destino y los offsets antes de probar el siguiente método
+        fsrc.seek(0)
+        fdst.seek(0)
+        fdst.truncate()
+    shutil.copyfileobj(fsrc, fdst, length=16 * 1024 * 1024)
+
+def fast_copy(src, dst):
+    """
+    Copia src en dst (contenido y permisos, como shutil.copy) sin pasar los datos por el
+    espacio de usuario. Orden de preferencia: reflink FICLONE (Btrfs/XFS), copy_file_range,
+    sendfile y, como último recurso, una copia por bloques de 16 MiB. Solo se pasa al
+    siguiente método si el actual no está soportado; errores reales (ENOSPC, EIO) se propagan.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        _copy_data(fsrc, fdst)
+    shutil.copymode(src, dst)
+
+logger = get_logger("agente_9")
+
+_thread_buffers = threading.local()
+
+def _read_buffer():
+    """Búfer de lectura de 1 MiB por hilo: se reutiliza entre archivos sin reasignar memoria"""
+    view = getattr(_thread_buffers, "view", None)
+    if view is None:
+        view = _thread_buffers.view = memoryview(bytearray(1 << 20))
+    return view
+
+def _direct_buffer():
+    """Búfer de 1 MiB alineado a página (mmap anónimo) por hilo, requerido por O_DIRECT"""
+    buf = getattr(_thread_buffers, "direct", None)
+    if buf is None:
+        buf = _thread_buffers.direct = mmap.mmap(-1, 1 << 20)
+    return buf
+
+def _hash_direct(file_path, digest):
+    """
+    Lee el archivo con O_DIRECT (sin pasar por el page cache) en bloques alineados.
+    Devuelve False si el sistema de archivos no admite O_DIRECT.
+    """
+    try:
+        fd = os.open(file_path, os.O_RDONLY | os.O_DIRECT)
+    except OSError:
+        return False
+    try:
+        buf = _direct_buffer()
+        view = memoryview(buf)
+        try:
+            while n := os.readv(fd, [buf]):
+                digest.update(view[:n])
+        finally:
+            view.release()
+    except OSError:
+        # p. ej. EINVAL en sistemas de archivos que aceptan la bandera pero no la lectura directa
+        return False
+    finally:
+        os.close(fd)
+    return True
+
+def hash_file(file_path, algorithm="sha256", direct_io=False):
+    """
+    Calcula el hash de un archivo (función de módulo: se ejecuta en procesos hijos).
+    SHA-256 usa el backend de OpenSSL de hashlib, que aprovecha SHA-NI cuando el CPU lo tiene.
+    Con direct_io (Linux) las lecturas evitan el page cache en barridos completos.
+    """
+    if algorithm == "blake3":
+        if blake3 is None:
+            raise RuntimeError("El algoritmo blake3 requiere el paquete 'blake3'")
+        return blake3.blake3(max_threads=blake3.blake3.AUTO).update_mmap(file_path).hexdigest()
+    digest = hashlib.new(algorithm)
+    if direct_io and hasattr(os, "O_DIRECT"):
+        if _hash_direct(file_path, digest):
+            return digest.hexdigest()
+        digest = hashlib.new(algorithm)
+    view = _read_buffer()
+    with open(file_path, "rb", buffering=0) as f:
+        # Lectura secuencial en bloques de 1 MiB sobre el búfer reutilizado del hilo
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while n := f.readinto(view):
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+def lower_thread_priority():
+    """
+    Pasa el hilo actual a SCHED_IDLE (solo Linux, donde la política es por hilo) para que
+    únicamente use CPU ociosa; los hilos que cree después la heredan. En otras plataformas
+    no hace nada: nice() afectaría a todo el proceso, incluido el hilo principal.
+    Retorna True si se aplicó.
+    """
+    try:
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+        return True
+    except (AttributeError, OSError):
+        return False
+
+def file_signature(st):
+    """
+    Firma de un archivo para memorizar su digest. Incluye st_ctime_ns: el usuario no puede
+    fijarlo (utime lo actualiza), así que reescribir el archivo con mismo tamaño y restaurar
+    su mtime no reutiliza un digest viejo. Las firmas antiguas sin ctime nunca coinciden.
+    """
+    return (st.st_mtime_ns, st.st_size, st.st_ino, st.st_ctime_ns)
+
+def run_in_thread(func, *args):
+    """
+    Equivalente a asyncio.to_thread sin copy_context(): los agentes no usan contextvars,
+    así que se evita copiar el contexto en cada envío al executor por defecto.
+    """
+    return asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+def run_async(coro):
+    """Ejecuta una corrutina hasta completarse en un event loop propio (uvloop si está disponible)"""
+    loop = new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
 
 # ======================
 # CONFIGURACIÓN DEL SISTEMA
 # ======================
 class BackupConfig:
     """Configuración del sistema de respaldos y prioridades"""
-    def __init__(self):
+    def __init__(self, hash_algorithm="sha256"):
         self.backup_dir = "backups"
         self.production_dir = "production"
-        self.hash_db = "hash_db.json"
+        # Cada algoritmo tiene su propia base de hashes: los digests no son comparables entre sí
+        self.hash_algorithm = hash_algorithm
+        self.hash_db = "hash_db.json" if hash_algorithm == "sha256" else f"hash_db_{hash_algorithm}.json"
+        # Memoria persistente de digests por firma de archivo (sobrevive a reinicios)
+        self.memo_path = f"hash_memo_{hash_algorithm}"
+        # Lecturas O_DIRECT al hashear: evita desplazar el page cache con respaldos grandes
+        self.direct_io = False
         self.critical_services = self.load_critical_services()
+        # Se incrementa con cada cambio de servicios para invalidar planes precalculados
+        self.version = 0
+    
+    def update_critical_services(self, services):
+        """Reemplaza la jerarquía de servicios críticos"""
+        self.critical_services = services
+        self.version += 1
         
     def load_critical_services(self):
         """Carga la jerarquía de servicios críticos desde archivo"""
@@ -39,62 +238,289 @@ class BackupConfig:
 # ======================
 # AGENTE DE VALIDACIÓN
 # ======================
+class BackupListingHandler(FileSystemEventHandler):
+    """Invalida el listado de respaldos en caché cuando se crean, borran o mueven archivos"""
+    def __init__(self, agent):
+        self.agent = agent
+
+    def on_created(self, event):
+        self.agent._listing_gen += 1
+
+    def on_deleted(self, event):
+        self.agent._listing_gen += 1
+
+    def on_moved(self, event):
+        self.agent._listing_gen += 1
+
 class ValidationAgent:
     """Agente que verifica la integridad de los respaldos"""
-    def __init__(self, config):
+    def __init__(self, config, executor=None):
         self.config = config
+        # Pool de procesos opcional para hashear en varios núcleos; sin él se hashea en el hilo actual
+        self.executor = executor
         self.integrity_status = {}
+        # Base de hashes conocidos: se carga una vez y se persiste con flush_hash_db
+        self.known_hashes = self.load_hash_db()
+        self._hash_db_dirty = False
+        # Protege known_hashes cuando varios hilos verifican respaldos a la vez
+        self._hash_lock = threading.Lock()
+        # Hash memorizado por respaldo junto con su firma (mtime_ns, tamaño, inodo, ctime_ns);
+        # se precarga del disco y los cambios se escriben al cierre de cada ciclo
+        self._digest_cache = self.load_digest_memo()
+        self._memo_changes = {}
+        self._memo_lock = threading.Lock()
+        # Serializa los volcados a disco: validación y orquestación pueden terminar a la vez
+        self._flush_lock = threading.Lock()
+        # Cambios al memo fragmentados por hilo: los trabajadores no comparten un dict mutable
+        # durante el ciclo y los fragmentos se integran al cierre (merge_digest_shards)
+        self._shards = threading.local()
+        self._shard_maps = []
+        self._shard_epoch = 0
+        # Listado de respaldos en caché, invalidado por eventos de watchdog (start_watching)
+        self._observer = None
+        self._listing_gen = 0
+        self._listing = None
+        
+    def load_hash_db(self):
+        """Carga la base de datos de hashes conocidos"""
+        try:
+            with open(self.config.hash_db, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+    
+    def start_watching(self):
+        """Suscribe el agente a los eventos del directorio de respaldos"""
+        if self._observer is not None:
+            return
+        observer = Observer()
+        observer.schedule(BackupListingHandler(self), self.config.backup_dir, recursive=False)
+        observer.start()
+        self._observer = observer
+    
+    def stop_watching(self):
+        """Detiene la suscripción; los ciclos posteriores vuelven a listar el directorio"""
+        observer, self._observer = self._observer, None
+        if observer is not None:
+            observer.stop()
+            observer.join()
+        self._listing = None
+    
+    def list_backups(self):
+        """Nombres de los respaldos; con watchdog activo solo se relista tras un cambio"""
+        if self._observer is None:
+            return os.listdir(self.config.backup_dir)
+        gen = self._listing_gen
+        cached = self._listing
+        if cached is not None and cached[0] == gen:
+            return cached[1]
+        # La generación se lee antes de listar: un evento concurrente invalida este resultado
+        backups = os.listdir(self.config.backup_dir)
+        self._listing = (gen, backups)
+        return backups
+    
+    def load_digest_memo(self):
+        """Carga los digests memorizados en ejecuciones anteriores"""
+        with shelve.open(self.config.memo_path, flag="c") as memo:
+            return dict(memo)
+    
+    def _shard(self):
+        """Fragmento de cambios del hilo actual (se registra una vez por época de integración)"""
+        local = self._shards
+        if getattr(local, "epoch", None) != self._shard_epoch:
+            with self._memo_lock:
+                local.map = {}
+                local.epoch = self._shard_epoch
+                self._shard_maps.append(local.map)
+        return local.map
+    
+    def _remember_digest(self, backup_file, entry):
+        """Anota en el fragmento del hilo un digest nuevo (entry=None lo elimina)"""
+        self._shard()[backup_file] = entry
+    
+    def merge_digest_shards(self):
+        """Integra los fragmentos de todos los hilos a la memoria compartida bajo un solo lock"""
+        with self._memo_lock:
+            shards, self._shard_maps = self._shard_maps, []
+            self._shard_epoch += 1
+            for shard in shards:
+                # Un hilo rezagado que escriba tras este corte solo provoca un rehash posterior
+                for backup_file, entry in list(shard.items()):
+                    if entry is None:
+                        if self._digest_cache.pop(backup_file, None) is None:
+                            continue
+                    else:
+                        self._digest_cache[backup_file] = entry
+                    self._memo_changes[backup_file] = entry
+    
+    def flush_digest_memo(self):
+        """Escribe en disco los digests memorizados que cambiaron desde el último volcado"""
+        with self._flush_lock:
+            self.merge_digest_shards()
+            with self._memo_lock:
+                if not self._memo_changes:
+                    return
+                changes, self._memo_changes = self._memo_changes, {}
+            try:
+                with shelve.open(self.config.memo_path, flag="c") as memo:
+                    for backup_file, entry in changes.items():
+                        if entry is None:
+                            memo.pop(backup_file, None)
+                        else:
+                            memo[backup_file] = entry
+            except BaseException:
+                # Los cambios vuelven a quedar pendientes, sin pisar otros más recientes
+                with self._memo_lock:
+                    self._memo_changes = {**changes, **self._memo_changes}
+                raise
+    
+    def flush_hash_db(self):
+        """Persiste de forma atómica los hashes conocidos si hubo cambios"""
+        # El lock de volcado cubre la instantánea, la escritura y el replace: una instantánea
+        # más antigua nunca puede reemplazar en disco a una más reciente
+        with self._flush_lock:
+            with self._hash_lock:
+                if not self._hash_db_dirty:
+                    return
+                snapshot = dict(self.known_hashes)
+                self._hash_db_dirty = False
+            directory = os.path.dirname(os.path.abspath(self.config.hash_db))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_path, self.config.hash_db)
+            except BaseException:
+                os.unlink(tmp_path)
+                with self._hash_lock:
+                    self._hash_db_dirty = True
+                raise
         
     def calculate_hash(self, file_path):
-        """Calcula hash SHA-256 para verificar integridad"""
-        sha256 = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            while chunk := f.read(4096):
-                sha256.update(chunk)
-        return sha256.hexdigest()
+        """Calcula el hash configurado (SHA-256 por defecto) para verificar integridad"""
+        algorithm = self.config.hash_algorithm
+        direct_io = self.config.direct_io
+        executor = self.executor
+        if executor is None:
+            return hash_file(file_path, algorithm, direct_io)
+        return executor.submit(hash_file, file_path, algorithm, direct_io).result()
     
-    def verify_backup(self, backup_file):
-        """Verifica la integridad de un respaldo específico"""
+    def current_digest(self, backup_file):
+        """Digest actual del respaldo (memorizado por firma) o None si no existe"""
         backup_path = os.path.join(self.config.backup_dir, backup_file)
         
-        if not os.path.exists(backup_path):
-            return False, "Backup no encontrado"
-        
-        current_hash = self.calculate_hash(backup_path)
-        
-        # Cargar base de datos de hashes conocidos
         try:
-            with open(self.config.hash_db, "r") as f:
-                known_hashes = json.load(f)
+            st = os.stat(backup_path)
         except FileNotFoundError:
-            known_hashes = {}
+            self._remember_digest(backup_file, None)
+            return None
         
-        # Verificar contra hash conocido
-        if backup_file in known_hashes:
-            if known_hashes[backup_file] == current_hash:
-                return True, "Integridad verificada"
-            return False, "Hash no coincide"
-        
-        # Si es nuevo backup, registrar hash
-        known_hashes[backup_file] = current_hash
-        with open(self.config.hash_db, "w") as f:
-            json.dump(known_hashes, f)
-        
-        return True, "Nuevo backup registrado"
+        # Solo se vuelve a leer el archivo si su firma cambió desde el último hash
+        signature = file_signature(st)
+        cached = self._shard().get(backup_file)
+        if cached is None:
+            cached = self._digest_cache.get(backup_file)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        current_hash = self.calculate_hash(backup_path)
+        self._remember_digest(backup_file, (signature, current_hash))
+        return current_hash
+    
+    def verify_backup(self, backup_file):
+        """Verifica la integridad de un respaldo específico"""
+        return self.check_digests({backup_file: self.current_digest(backup_file)})[backup_file]
+    
+    def check_digests(self, digests):
+        """
+        Compara en bloque los digests calculados ({respaldo: hex o None}) contra los conocidos:
+        ambos lados se empaquetan como matrices uint8 y se comparan en una sola operación.
+        Registra los respaldos nuevos y devuelve {respaldo: (válido, mensaje)}.
+        """
+        verdicts = {}
+        with self._hash_lock:
+            known_hashes = self.known_hashes
+            by_length = {}  # longitud del digest -> [(respaldo, calculado, esperado)]
+            for backup_file, current_hash in digests.items():
+                if current_hash is None:
+                    verdicts[backup_file] = (False, "Backup no encontrado")
+                    continue
+                if backup_file not in known_hashes:
+                    # Si es nuevo backup, registrar hash (se persiste al final del ciclo)
+                    known_hashes[backup_file] = current_hash
+                    self._hash_db_dirty = True
+                    verdicts[backup_file] = (True, "Nuevo backup registrado")
+                    continue
+                computed = bytes.fromhex(current_hash)
+                try:
+                    expected = bytes.fromhex(known_hashes[backup_file])
+                except (TypeError, ValueError):
+                    # Entrada corrupta en la base de hashes: se reporta como discrepancia
+                    expected = None
+                if expected is None or len(expected) != len(computed):
+                    verdicts[backup_file] = (False, "Hash no coincide")
+                else:
+                    by_length.setdefault(len(computed), []).append((backup_file, computed, expected))
+            
+            # Verificar contra hash conocido: una comparación vectorizada por longitud de digest
+            for group in by_length.values():
+                computed = np.frombuffer(b"".join(entry[1] for entry in group), dtype=np.uint8)
+                expected = np.frombuffer(b"".join(entry[2] for entry in group), dtype=np.uint8)
+                ok = (computed.reshape(len(group), -1) == expected.reshape(len(group), -1)).all(axis=1)
+                for (backup_file, _, _), is_valid in zip(group, ok.tolist()):
+                    verdicts[backup_file] = ((True, "Integridad verificada") if is_valid
+                                             else (False, "Hash no coincide"))
+        return verdicts
+    
+    def prefetch_backups(self, backups):
+        """
+        Solicita al kernel, en una sola pasada, la lectura anticipada de los respaldos
+        que habrá que volver a hashear; el disco trabaja en paralelo con el hashing.
+        """
+        # Con O_DIRECT la lectura anticipada al page cache no se aprovecharía
+        if self.config.direct_io or not hasattr(os, "posix_fadvise"):
+            return
+        for backup_file in backups:
+            backup_path = os.path.join(self.config.backup_dir, backup_file)
+            # Solo se abren los respaldos cuya firma no coincide con el digest memorizado:
+            # en estado estable cuesta un stat por archivo y ninguna apertura
+            try:
+                st = os.stat(backup_path)
+            except OSError:
+                continue
+            cached = self._digest_cache.get(backup_file)
+            if cached is not None and cached[0] == file_signature(st):
+                continue
+            try:
+                fd = os.open(backup_path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
     
     def full_validation_cycle(self):
         """Ejecuta verificación completa de todos los respaldos"""
-        print("\n[Agente Validación] Iniciando verificación de integridad...")
-        for backup in os.listdir(self.config.backup_dir):
-            is_valid, message = self.verify_backup(backup)
+        logger.info({'event': 'validation_started'})
+        backups = self.list_backups()
+        self.prefetch_backups(backups)
+        # hashlib libera el GIL al procesar bloques grandes: las lecturas se solapan entre archivos
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            futures = {executor.submit(self.current_digest, backup): backup for backup in backups}
+            digests = {futures[future]: future.result() for future in as_completed(futures)}
+        
+        checked_at = datetime.now().isoformat()
+        for backup, (is_valid, message) in self.check_digests(digests).items():
             self.integrity_status[backup] = {
                 "valid": is_valid,
                 "message": message,
-                "last_checked": datetime.now().isoformat()
+                "last_checked": checked_at
             }
-            status = "✓" if is_valid else "✗"
-            print(f"  {status} {backup}: {message}")
-        print("[Agente Validación] Verificación completada\n")
+            logger.log(logging.INFO if is_valid else logging.WARNING,
+                       {'event': 'backup_checked', 'backup': backup, 'valid': is_valid, 'message': message})
+        self.flush_hash_db()
+        self.flush_digest_memo()
+        logger.info({'event': 'validation_completed', 'backups': len(backups)})
         return self.integrity_status
 
 # ======================
@@ -102,11 +528,25 @@ class ValidationAgent:
 # ======================
 class OrchestrationAgent:
     """Agente que gestiona restauraciones priorizadas"""
-    def __init__(self, config, validation_agent):
+    def __init__(self, config, validation_agent, validation_ttl=300):
         self.config = config
         self.validation_agent = validation_agent
+        # Segundos durante los que se confía en el último resultado de validación
+        self.validation_ttl = validation_ttl
         self.restoration_queue = queue.PriorityQueue()
         self.current_demands = {}
+        self._load_services()
+        
+    def _load_services(self):
+        """Inventario de servicios como arreglos paralelos para priorizar en bloque"""
+        services = self.config.critical_services
+        self._service_names = np.array(list(services))
+        self._base_priorities = np.array([d["priority"] for d in services.values()], dtype=np.float64)
+        self._thresholds = np.array([d["demand_threshold"] for d in services.values()], dtype=np.float64)
+        self._config_version = self.config.version
+        # Plan de restauración vigente y la llave (versión, fecha, demandas) con que se construyó
+        self._plan = None
+        self._plan_key = None
         
     def evaluate_demands(self):
         """Evalúa la demanda actual de servicios (simulado)"""
@@ -120,30 +560,27 @@ class OrchestrationAgent:
     
     def prioritize_services(self):
         """Prioriza servicios basado en criticidad y demanda actual"""
-        demands = self.evaluate_demands()
-        priority_list = []
+        return self._priority_order(self.evaluate_demands())
+    
+    def _priority_order(self, demands):
+        """Nombres de servicio ordenados por prioridad para las demandas dadas"""
+        current = np.fromiter((demands.get(name, 0) for name in self._service_names),
+                              dtype=np.float64, count=len(self._service_names))
+        demand_ratio = current / self._thresholds
         
-        for service, data in self.config.critical_services.items():
-            current_demand = demands.get(service, 0)
-            demand_ratio = current_demand / data["demand_threshold"]
-            
-            # Fórmula de prioridad: (Prioridad base) * (Factor demanda)
-            # Menor valor = mayor prioridad
-            priority = data["priority"] * (1 / max(0.1, demand_ratio))
-            
-            priority_list.append((priority, service))
+        # Fórmula de prioridad: (Prioridad base) * (Factor demanda)
+        # Menor valor = mayor prioridad
+        priority = self._base_priorities / np.maximum(0.1, demand_ratio)
         
         # Ordenar por prioridad (menor primero)
-        priority_list.sort(key=lambda x: x[0])
-        return [service for _, service in priority_list]
+        return self._service_names[np.argsort(priority, kind="stable")].tolist()
     
     def restore_service(self, service, backup_file, partial=False):
         """Realiza la restauración de un servicio"""
-        print(f"[Orquestador] Iniciando restauración de {service} ({'parcial' if partial else 'completa'})")
+        logger.info({'event': 'restore_started', 'service': service, 'partial': partial})
         
         # Validar backup antes de restaurar
-        is_valid, _ = self.validation_agent.verify_backup(backup_file)
-        if not is_valid:
+        if not self._is_backup_valid(backup_file):
             return False, "Backup inválido"
         
         source = os.path.join(self.config.backup_dir, backup_file)
@@ -156,42 +593,97 @@ class OrchestrationAgent:
                 
             if partial:
                 # Restauración parcial simulada
-                shutil.copy(source, os.path.join(target, "partial_restore"))
+                fast_copy(source, os.path.join(target, "partial_restore"))
             else:
                 # Restauración completa simulada
-                shutil.copy(source, os.path.join(target, "full_restore"))
+                fast_copy(source, os.path.join(target, "full_restore"))
             
-            # Simular tiempo de restauración
-            time.sleep(1)
             return True, "Restauración exitosa"
             
         except Exception as e:
             return False, str(e)
     
-    def orchestrate_restorations(self, trigger_event=None):
-        """Orquesta las restauraciones basado en prioridades"""
-        print("\n[Agente Orquestación] Evaluando prioridades...")
-        prioritized = self.prioritize_services()
-        print(f"Orden de prioridad: {', '.join(prioritized)}")
-        
-        results = {}
+    def _is_backup_valid(self, backup_file):
+        """Usa el resultado reciente del ciclo de validación; solo recalcula el hash si expiró"""
+        status = self.validation_agent.integrity_status.get(backup_file)
+        if status is not None:
+            age = datetime.now() - datetime.fromisoformat(status["last_checked"])
+            if age.total_seconds() < self.validation_ttl:
+                return status["valid"]
+        is_valid, _ = self.validation_agent.verify_backup(backup_file)
+        return is_valid
+    
+    def build_plan(self, prioritized, date_tag):
+        """Construye el plan (servicio, respaldo, parcial, cubre_demanda) en orden de prioridad"""
+        plan = []
         for service in prioritized:
             # Backup file naming convention: servicio_fecha.ext
-            backup_file = f"{service}_backup_{datetime.now().strftime('%Y%m%d')}.bak"
+            backup_file = f"{service}_backup_{date_tag}.bak"
             
             # Determinar tipo de restauración (parcial para demandas medias)
             current_demand = self.current_demands.get(service, 0)
             threshold = self.config.critical_services[service]["demand_threshold"]
             partial = current_demand < threshold * 1.5
+            # Un servicio con demanda bajo el umbral cubre la demanda si se restaura con éxito
+            plan.append((service, backup_file, partial, current_demand < threshold))
+        return plan
+    
+    def get_plan(self):
+        """Devuelve el plan vigente; solo se recalcula si cambian la configuración, la fecha o la demanda"""
+        if self._config_version != self.config.version:
+            self._load_services()
+        demands = self.evaluate_demands()
+        date_tag = datetime.now().strftime('%Y%m%d')
+        key = (self._config_version, date_tag, tuple(demands.items()))
+        if key != self._plan_key:
+            self._plan = self.build_plan(self._priority_order(demands), date_tag)
+            self._plan_key = key
+        return self._plan
+    
+    def orchestrate_restorations(self, trigger_event=None):
+        """Orquesta las restauraciones basado en prioridades"""
+        return run_async(self.orchestrate_restorations_async(trigger_event))
+
+    async def orchestrate_restorations_async(self, trigger_event=None):
+        """Versión asíncrona de orchestrate_restorations para componer con otras tareas"""
+        logger.info({'event': 'orchestration_started'})
+        plan = self.get_plan()
+        logger.info({'event': 'priority_order', 'services': [step[0] for step in plan]})
+        
+        results = await self._run_restorations(plan)
+        
+        await run_in_thread(self.validation_agent.flush_hash_db)
+        await run_in_thread(self.validation_agent.flush_digest_memo)
+        logger.info({'event': 'orchestration_completed', 'results': results})
+        return results
+
+    async def _run_restorations(self, plan):
+        """
+        Ejecuta en paralelo cada tramo del plan: los servicios en orden de prioridad
+        hasta el primero que cubre la demanda (inclusive). Solo si ese falla se
+        continúa con el siguiente tramo, igual que el recorrido secuencial.
+        """
+        results = {}
+        pending = list(plan)
+        while pending:
+            batch = []
+            for step in pending:
+                batch.append(step)
+                if step[3]:
+                    break
+            pending = pending[len(batch):]
             
-            success, message = self.restore_service(service, backup_file, partial)
-            results[service] = {"success": success, "message": message}
+            outcomes = await asyncio.gather(*(
+                run_in_thread(self.restore_service, service, backup_file, partial)
+                for service, backup_file, partial, _ in batch
+            ))
+            for (service, _, _, _), (success, message) in zip(batch, outcomes):
+                results[service] = {"success": success, "message": message}
             
             # Solo restaurar servicios críticos necesarios
-            if success and current_demand < threshold:
+            last_service, _, _, covers_demand = batch[-1]
+            if covers_demand and results[last_service]["success"]:
                 break
-        
-        print("[Agente Orquestación] Proceso de restauración completado\n")
         return results
 
 # ======================
@@ -201,49 +693,174 @@ class CyberResilienceSystem:
     """Sistema principal de ciberresiliencia"""
     def __init__(self):
         self.config = BackupConfig()
+        # El hashing de respaldos se reparte entre procesos para no quedar limitado por el GIL.
+        # El pool vive lo mismo que el sistema (se libera en close()), no lo que el monitoreo
+        self._pool = None
+        self._pool_idle = False
         self.validation_agent = ValidationAgent(self.config)
+        self._ensure_pool(idle_priority=False)
         self.orchestration_agent = OrchestrationAgent(
             self.config, 
             self.validation_agent
         )
-        self.monitor_active = False
-        
-    def start_monitoring(self, interval=60):
-        """Inicia monitoreo continuo en segundo plano"""
-        self.monitor_active = True
-        print(f"🔍 Iniciando monitoreo de resiliencia (intervalo: {interval}s)")
-        
-        def monitoring_loop():
-            while self.monitor_active:
-                # Validar backups primero
-                self.validation_agent.full_validation_cycle()
-                
-                # Verificar si se necesita restauración (simulado)
-                if self.detect_incident():
-                    self.orchestration_agent.orchestrate_restorations()
-                
-                time.sleep(interval)
+        # Monitoreo: un event loop en su propio hilo con un temporizador que se re-arma
+        self._loop = None
+        self._thread = None
+        self._timer = None
+        self._cycle = None
+        self._stopping = False
+        # Parámetros del monitoreo en curso (los fija start_monitoring)
+        self._interval = None
+        self._idle_priority = False
+        self._new_cycle = None
+        # La detección simulada siempre reporta incidente; en False se consulta detect_incident()
+        self.always_incident = True
+        # Detección aleatoria: bitmap precalculado de sorteos, consumido con un contador
+        self.incident_probability = 0.2
+        self._incident_bits = None
+        self._ib_idx = 0
         
-        threading.Thread(target=monitoring_loop, daemon=True).start()
+    def start_monitoring(self, interval=60, idle_priority=False):
+        """
+        Inicia monitoreo continuo en segundo plano. Con idle_priority el hilo de monitoreo
+        (y los hilos/procesos de hashing que lance) solo compiten por CPU ociosa.
+        Si el monitoreo ya está activo no se crea otro hilo.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            logger.warning({'event': 'monitoring_already_running'})
+            return
+        logger.info({'event': 'monitoring_started', 'interval': interval, 'idle_priority': idle_priority})
+        self._interval = interval
+        self._idle_priority = idle_priority
+        # Los trabajadores pudieron crearse ya desde el hilo principal (validación inicial) y no
+        # heredarían la política: si cambia la prioridad pedida se reemplaza el pool
+        self._ensure_pool(idle_priority)
+        self.validation_agent.start_watching()
+        # Métodos y predicado constante resueltos una sola vez, fuera de cada ciclo
+        detect = None if self.always_incident else self.detect_incident
+        self._new_cycle = functools.partial(
+            self._monitoring_cycle,
+            self.validation_agent.full_validation_cycle,
+            self.orchestration_agent.orchestrate_restorations_async,
+            detect,
+        )
+        self._stopping = False
+        self._loop = new_event_loop()
+        # Hilo no-daemon: el apagado pasa por stop_monitoring(), que espera el ciclo en curso
+        self._thread = threading.Thread(target=self._run_monitor_loop, name="resilience-monitor")
+        self._thread.start()
+    
+    def _run_monitor_loop(self):
+        """Cuerpo del hilo de monitoreo: el loop duerme en el kernel hasta el siguiente ciclo"""
+        if self._idle_priority:
+            lower_thread_priority()
+        loop = self._loop
+        asyncio.set_event_loop(loop)
+        self._timer = loop.call_soon(self._tick)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+    
+    def _tick(self):
+        """Lanza un ciclo de monitoreo; el siguiente se programa al terminar este"""
+        self._cycle = self._loop.create_task(self._new_cycle())
+        self._cycle.add_done_callback(self._cycle_done)
+    
+    def _cycle_done(self, task):
+        """Registra el resultado del ciclo y programa el siguiente (o detiene el loop)"""
+        self._cycle = None
+        exc = None if task.cancelled() else task.exception()
+        if exc is not None:
+            # Un ciclo fallido se reporta y el monitoreo continúa en el siguiente intervalo
+            logger.error({'event': 'monitoring_cycle_failed', 'error': f"{type(exc).__name__}: {exc}"},
+                         exc_info=(type(exc), exc, exc.__traceback__))
+        if self._stopping:
+            self._loop.stop()
+            return
+        self._timer = self._loop.call_later(self._interval, self._tick)
+    
+    def _request_stop(self):
+        """Se ejecuta en el hilo del loop: cancela el temporizador o espera el ciclo en curso"""
+        self._stopping = True
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._cycle is None:
+            self._loop.stop()
+    
+    async def _monitoring_cycle(self, validate, orchestrate, detect):
+        """
+        Lanza en paralelo la validación de respaldos y, si hay incidente, la orquestación.
+        Los respaldos que la validación aún no cubre se verifican dentro de la restauración.
+        """
+        tasks = [run_in_thread(validate)]
+        # Verificar si se necesita restauración (simulado)
+        if detect is None or detect():
+            tasks.append(orchestrate())
+        # Se espera a ambas ramas aunque una falle: una restauración nunca queda corriendo
+        # sin supervisión (ni se solapa con la del siguiente ciclo); luego se propaga el error
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+    
+    def _ensure_pool(self, idle_priority):
+        """
+        Garantiza un pool de hashing abierto con la prioridad pedida; con idle_priority
+        cada trabajador pasa a SCHED_IDLE al iniciar.
+        """
+        if self._pool is not None and self._pool_idle == idle_priority:
+            return
+        if self._pool is not None:
+            self._pool.shutdown()
+        initializer = lower_thread_priority if idle_priority else None
+        self._pool = ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=initializer)
+        self._pool_idle = idle_priority
+        self.validation_agent.executor = self._pool
     
     def stop_monitoring(self):
-        """Detiene el monitoreo continuo"""
-        self.monitor_active = False
-        print("⏹️ Monitoreo detenido")
+        """
+        Detiene el monitoreo continuo y espera a que termine el ciclo en curso.
+        El pool de hashing sigue disponible (restauraciones manuales, nuevo start_monitoring).
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._request_stop)
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+        self.validation_agent.stop_watching()
+        logger.info({'event': 'monitoring_stopped'})
+    
+    def close(self):
+        """Detiene el monitoreo y libera el pool de procesos; hashes posteriores son en línea"""
+        self.stop_monitoring()
+        self.validation_agent.executor = None
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
     
     def detect_incident(self):
         """Detecta incidentes simulados (en implementación real usaría monitoreo real)"""
-        # Simulación: 20% de probabilidad de incidente
-        return True #random.random() < 0.2
+        if self.always_incident:
+            return True
+        # Simulación: 20% de probabilidad de incidente; 65536 sorteos generados de una vez
+        if self._incident_bits is None or self._ib_idx == len(self._incident_bits):
+            self._incident_bits = np.random.random(1 << 16) < self.incident_probability
+            self._ib_idx = 0
+        hit = self._incident_bits[self._ib_idx]
+        self._ib_idx += 1
+        return bool(hit)
     
     def manual_restoration(self):
         """Inicia restauración manual"""
-        print("🛠️ Iniciando restauración manual...")
+        logger.info({'event': 'manual_restoration'})
         return self.orchestration_agent.orchestrate_restorations()
 
 # ======================
 # EJECUCIÓN PRINCIPAL
 # ======================
+# El hilo principal se bloquea en este evento hasta el apagado (sin despertares periódicos)
+shutdown_event = threading.Event()
+
 if __name__ == "__main__":
     # Inicializar sistema
     resilience_system = CyberResilienceSystem()
@@ -256,8 +873,8 @@ if __name__ == "__main__":
     
     # Mantener el programa activo
     try:
-        while True:
-            time.sleep(1)
+        shutdown_event.wait()
     except KeyboardInterrupt:
-        resilience_system.stop_monitoring()
-        print("Sistema apagado")
\ No newline at end of file
+        resilience_system.close()
+        shutdown_event.set()
+        logger.info({'event': 'shutdown'})
\ No newline at end of file
@@ -0,0 +1,59 @@
+# _____________________
+# Registro estructurado compartido por los agentes: los hilos de trabajo solo encolan
+# el evento (dict) y un QueueListener en segundo plano lo serializa a JSON con orjson,
+# de modo que el camino crítico no construye cadenas ni compite por el lock de la salida.
+# oswaldo.diaz@inegi.org.mx
+# _____________________
+import atexit
+import logging
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+class OrjsonFormatter(logging.Formatter):
+    """
+    Serializa cada registro como una línea JSON con marca de tiempo, nivel y logger.
+    Si el mensaje es un dict se integra tal cual; en otro caso va en la llave 'message'.
+    """
+    def format(self, record):
+        event = record.msg if isinstance(record.msg, dict) else {'message': record.getMessage()}
+        entry = {'ts': record.created, 'level': record.levelname, 'logger': record.name, **event}
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+class _DeferredQueueHandler(QueueHandler):
+    """Encola el registro sin formatearlo; la serialización ocurre en el hilo del listener."""
+    def prepare(self, record):
+        return record
+
+_queue = queue.SimpleQueue()
+_listener = None
+_init_lock = threading.Lock()
+
+def _ensure_listener():
+    """Arranca (una sola vez por proceso) el listener que escribe en stderr."""
+    global _listener
+    with _init_lock:
+        if _listener is None:
+            stream = logging.StreamHandler(sys.stderr)
+            stream.setFormatter(OrjsonFormatter())
+            _listener = QueueListener(_queue, stream)
+            _listener.start()
+            atexit.register(_listener.stop)
+
+def get_logger(name, level=logging.INFO):
+    """
+    Devuelve un logger cuyos eventos se procesan en segundo plano.
+    Uso: logger.info({'event': 'detected', 'path': path})
+    """
+    _ensure_listener()
+    logger = logging.getLogger(name)
+    if not any(isinstance(h, _DeferredQueueHandler) for h in logger.handlers):
+        logger.addHandler(_DeferredQueueHandler(_queue))
+        logger.setLevel(level)
+        logger.propagate = False
+    return logger